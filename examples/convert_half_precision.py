@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+import torch
+sys.path.append("../")
+from model import Kronos, KronosTokenizer
+
+# Writes bf16/fp16 copies of a Kronos tokenizer and model, half the size of the fp32 checkpoints.
+# `from_pretrained` keeps the stored dtype, so they load in half precision, and a KronosPredictor with the same
+# precision uses the loaded weights as they are instead of casting a copy, e.g.
+#   KronosPredictor(Kronos.from_pretrained(".../model"), KronosTokenizer.from_pretrained(".../tokenizer"), precision="bf16")
+
+DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Kronos checkpoints to half precision")
+    parser.add_argument("--tokenizer", type=str, default="NeoQuasar/Kronos-Tokenizer-base", help="Tokenizer hub id or local path")
+    parser.add_argument("--model", type=str, default="NeoQuasar/Kronos-small", help="Model hub id or local path")
+    parser.add_argument("--precision", type=str, default="bf16", choices=list(DTYPES), help="Precision of the written weights")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory receiving the tokenizer/ and model/ checkpoints")
+    args = parser.parse_args()
+
+    dtype = DTYPES[args.precision]
+    tokenizer = KronosTokenizer.from_pretrained(args.tokenizer).half_precision(dtype)
+    model = Kronos.from_pretrained(args.model).half_precision(dtype)
+
+    for name, module in (("tokenizer", tokenizer), ("model", model)):
+        save_path = os.path.join(args.output_dir, name)
+        module.save_pretrained(save_path)
+        size = sum(os.path.getsize(os.path.join(save_path, f)) for f in os.listdir(save_path))
+        print(f"Saved {args.precision} {name} to {save_path} ({size / 2 ** 20:.1f} MiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import io
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+import sys
+sys.path.append("../")
+from model import Kronos, KronosTokenizer, KronosPredictor
+
+# Forecast drift of the int8 dynamically quantized CPU inference mode (`KronosPredictor(quantize=True)`)
+# against fp32, together with its throughput and weight memory.
+
+
+def kl_div(ref_logits, logits):
+    ref_logp = F.log_softmax(ref_logits, dim=-1)
+    logp = F.log_softmax(logits, dim=-1)
+    return (ref_logp.exp() * (ref_logp - logp)).sum(-1)
+
+
+def weight_bytes(module):
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+# 1. Load Model and Tokenizer
+tokenizer = KronosTokenizer.from_pretrained("NeoQuasar/Kronos-Tokenizer-base")
+model = Kronos.from_pretrained("NeoQuasar/Kronos-small")
+tokenizer.eval()
+model.eval()
+
+fp32 = KronosPredictor(model, tokenizer, device="cpu", max_context=512)
+int8 = KronosPredictor(model, tokenizer, device="cpu", max_context=512, quantize=True)
+
+# 2. Prepare Data
+df = pd.read_csv("./data/XSHG_5min_600977.csv")
+df['timestamps'] = pd.to_datetime(df['timestamps'])
+cols = ['open', 'high', 'low', 'close', 'volume', 'amount']
+
+lookback = 400
+pred_len = 120
+sample_count = 8
+T, top_p = 1.0, 0.9
+
+x_df = df.loc[:lookback - 1, cols]
+x_timestamp = df.loc[:lookback - 1, 'timestamps']
+y_timestamp = df.loc[lookback:lookback + pred_len - 1, 'timestamps']
+
+# 3. Per-step distributions on the fp32 trajectory (teacher forcing, so both modes see identical tokens)
+x, x_stamp, y_stamp, _, _ = fp32._prepare_input(x_df, x_timestamp, y_timestamp)
+x, x_stamp, y_stamp = torch.from_numpy(x), torch.from_numpy(x_stamp), torch.from_numpy(y_stamp)
+with torch.no_grad():
+    s1, s2 = fp32.tokenizer.encode(x, half=True)
+    q_s1, q_s2 = int8.tokenizer.encode(x, half=True)
+    print(f"Context tokens unchanged by the int8 tokenizer: s1 {(s1 == q_s1).float().mean():.2%}, s2 {(s2 == q_s2).float().mean():.2%}")
+
+    ref_s1, ref_ctx = fp32.model.decode_s1(s1, s2, x_stamp)
+    q_s1_logits, q_ctx = int8.model.decode_s1(s1, s2, x_stamp)
+    next_s1 = ref_s1.argmax(-1)
+    ref_s2 = fp32.model.decode_s2(ref_ctx, next_s1)
+    q_s2_logits = int8.model.decode_s2(q_ctx, next_s1)
+    kl_s1 = kl_div(ref_s1, q_s1_logits)[0]
+    kl_s2 = kl_div(ref_s2, q_s2_logits)[0]
+    top1_s1 = (ref_s1.argmax(-1) == q_s1_logits.argmax(-1)).float().mean()
+print(f"s1 KL(fp32 || int8): mean {kl_s1.mean():.4e}, max {kl_s1.max():.4e}")
+print(f"s2 KL(fp32 || int8): mean {kl_s2.mean():.4e}, max {kl_s2.max():.4e}")
+print(f"s1 top-1 agreement: {top1_s1:.2%}")
+
+
+# 4. End-to-end forecast drift, compared with the sampling noise between two fp32 runs
+def forecast(predictor, seed):
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    pred_df = predictor.predict(df=x_df, x_timestamp=x_timestamp, y_timestamp=y_timestamp, pred_len=pred_len,
+                                T=T, top_p=top_p, sample_count=sample_count, verbose=False)
+    return pred_df, time.perf_counter() - start
+
+
+ref_a, fp32_time = forecast(fp32, 0)
+ref_b, _ = forecast(fp32, 1)
+quantized, int8_time = forecast(int8, 0)
+print(f"Close MAE, fp32 vs fp32 (different seeds): {np.abs(ref_a['close'] - ref_b['close']).mean():.4f}")
+print(f"Close MAE, fp32 vs int8:                   {np.abs(ref_a['close'] - quantized['close']).mean():.4f}")
+
+# 5. Throughput and weight memory
+print(f"Forecast time: fp32 {fp32_time:.2f}s, int8 {int8_time:.2f}s ({fp32_time / int8_time:.2f}x)")
+fp32_bytes = weight_bytes(fp32.model) + weight_bytes(fp32.tokenizer)
+int8_bytes = weight_bytes(int8.model) + weight_bytes(int8.tokenizer)
+print(f"Weights: fp32 {fp32_bytes / 2 ** 20:.1f} MiB, int8 {int8_bytes / 2 ** 20:.1f} MiB ({int8_bytes / fp32_bytes:.0%})")
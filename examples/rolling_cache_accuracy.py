@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+import sys
+sys.path.append("../")
+from model import Kronos, KronosTokenizer
+from model.kronos import auto_regressive_inference, calc_time_stamps, sample_from_logits
+
+# Accuracy report for the rolling KV cache (`rolling_cache=True`) against the default behaviour,
+# which re-encodes the last `max_context` tokens from scratch once a forecast runs past max_context.
+
+
+def kl_div(ref_logits, logits):
+    ref_logp = F.log_softmax(ref_logits, dim=-1)
+    logp = F.log_softmax(logits, dim=-1)
+    return (ref_logp.exp() * (ref_logp - logp)).sum(-1)
+
+
+# 1. Load Model and Tokenizer
+tokenizer = KronosTokenizer.from_pretrained("NeoQuasar/Kronos-Tokenizer-base")
+model = Kronos.from_pretrained("NeoQuasar/Kronos-small")
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
+tokenizer = tokenizer.to(device).eval()
+model = model.to(device).eval()
+
+max_context = 512
+lookback = 480
+pred_len = 240  # the last lookback + pred_len - max_context steps run past max_context
+sample_count = 8
+T, top_p = 1.0, 0.9
+
+# 2. Prepare Data (same normalization as KronosPredictor)
+df = pd.read_csv("./data/XSHG_5min_600977.csv")
+df['timestamps'] = pd.to_datetime(df['timestamps'])
+cols = ['open', 'high', 'low', 'close', 'volume', 'amount']
+
+x = df.loc[:lookback - 1, cols].values.astype(np.float32)
+x_mean, x_std = np.mean(x, axis=0), np.std(x, axis=0)
+x = np.clip((x - x_mean) / (x_std + 1e-5), -5, 5)
+x_stamp = calc_time_stamps(df.loc[:lookback - 1, 'timestamps']).values.astype(np.float32)
+y_stamp = calc_time_stamps(df.loc[lookback:lookback + pred_len - 1, 'timestamps']).values.astype(np.float32)
+
+x = torch.from_numpy(x[np.newaxis]).to(device)
+x_stamp = torch.from_numpy(x_stamp[np.newaxis]).to(device)
+y_stamp = torch.from_numpy(y_stamp[np.newaxis]).to(device)
+stamp = torch.cat([x_stamp, y_stamp], dim=1)
+
+# 3. Per-step distributions on a shared trajectory (teacher forcing, so both modes see identical tokens)
+with torch.no_grad():
+    tokens = list(tokenizer.encode(x, half=True))
+    for i in range(pred_len):
+        window = [t[:, -max_context:] for t in tokens]
+        s1_logits, context = model.decode_s1(window[0], window[1], stamp[:, lookback + i - window[0].size(1):lookback + i], last_only=True)
+        s1 = sample_from_logits(s1_logits[:, -1], temperature=T, top_k=0, top_p=top_p)
+        s2_logits = model.decode_s2(context, s1, last_only=True)
+        s2 = sample_from_logits(s2_logits[:, -1], temperature=T, top_k=0, top_p=top_p)
+        tokens = [torch.cat([tokens[0], s1], dim=1), torch.cat([tokens[1], s2], dim=1)]
+
+    kl_s1, kl_s2, top1_s1 = [], [], []
+    kv_cache = model.new_kv_cache(max_context)
+    start = max(lookback - max_context, 0)
+    roll_s1, roll_ctx = model.decode_s1(tokens[0][:, start:lookback], tokens[1][:, start:lookback], stamp[:, start:lookback],
+                                        kv_cache=kv_cache, last_only=True)
+    for pos in range(lookback - 1, lookback + pred_len - 1):
+        if pos >= lookback:
+            roll_s1, roll_ctx = model.decode_s1(tokens[0][:, pos:pos + 1], tokens[1][:, pos:pos + 1], stamp[:, pos:pos + 1],
+                                                kv_cache=kv_cache, last_only=True)
+        if pos + 1 <= max_context:
+            continue  # both modes are exact while the sequence fits in max_context
+
+        window_start = pos + 1 - max_context
+        ref_s1, ref_ctx = model.decode_s1(tokens[0][:, window_start:pos + 1], tokens[1][:, window_start:pos + 1], stamp[:, window_start:pos + 1],
+                                          last_only=True)
+        next_s1 = tokens[0][:, pos + 1:pos + 2]
+        ref_s2 = model.decode_s2(ref_ctx, next_s1, last_only=True)
+        roll_s2 = model.decode_s2(roll_ctx, next_s1, kv_cache=kv_cache, last_only=True)
+
+        kl_s1.append(kl_div(ref_s1[:, -1], roll_s1[:, -1]).item())
+        kl_s2.append(kl_div(ref_s2[:, -1], roll_s2[:, -1]).item())
+        top1_s1.append((ref_s1[:, -1].argmax(-1) == roll_s1[:, -1].argmax(-1)).float().item())
+
+print(f"Steps past max_context: {len(kl_s1)}")
+print(f"s1 KL(recompute || rolling): mean {np.mean(kl_s1):.4e}, max {np.max(kl_s1):.4e}")
+print(f"s2 KL(recompute || rolling): mean {np.mean(kl_s2):.4e}, max {np.max(kl_s2):.4e}")
+print(f"s1 top-1 agreement: {np.mean(top1_s1):.2%}")
+
+
+
+# 4. End-to-end forecast drift, compared with the sampling noise between two recompute runs
+def forecast(seed, rolling_cache):
+    torch.manual_seed(seed)
+    preds = auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, T=T, top_k=0, top_p=top_p,
+                                      sample_count=sample_count, rolling_cache=rolling_cache)
+    return preds[0, -pred_len:] * (x_std + 1e-5) + x_mean
+
+
+close = cols.index('close')
+ref_a, ref_b, rolling = forecast(0, False), forecast(1, False), forecast(0, True)
+print(f"Close MAE, recompute vs recompute (different seeds): {np.abs(ref_a - ref_b)[:, close].mean():.4f}")
+print(f"Close MAE, recompute vs rolling cache:               {np.abs(ref_a - rolling)[:, close].mean():.4f}")
@@ -116,6 +116,14 @@ class Config:
         self.inference_top_p = 0.9
         self.inference_top_k = 0
         self.inference_sample_count = 5
+        # Adaptive sampling: stop drawing samples for a symbol once the standard error of its mean close
+        # forecast (in units of its standard deviation) is below this value; inference_sample_count is then
+        # the maximum. None always draws inference_sample_count samples.
+        self.inference_sample_tolerance = None
+        # Seed of the backtest sampling. Every window draws its own random numbers, derived from this seed, its
+        # symbol and its timestamp, so its forecast does not depend on the batch it is evaluated in. None uses
+        # torch's global RNG.
+        self.inference_seed = None
         self.backtest_batch_size = 1000
         self.backtest_benchmark = self._set_benchmark(self.instrument)
 
@@ -2,6 +2,7 @@ import os
 import sys
 import argparse
 import pickle
+import zlib
 from collections import defaultdict
 
 import numpy as np
@@ -22,7 +23,7 @@ from qlib.utils.time import Freq
 # Ensure project root is in the Python path
 sys.path.append("../")
 from config import Config
-from model.kronos import Kronos, KronosTokenizer, auto_regressive_inference
+from model.kronos import Kronos, KronosTokenizer, auto_regressive_inference, auto_regressive_adaptive
 
 
 # =================================================================================
@@ -236,6 +237,16 @@ def collate_fn_for_inference(batch):
     return x_batch, x_stamp_batch, y_stamp_batch, list(symbols), list(timestamps)
 
 
+def window_seeds(seed, symbols, timestamps):
+    """
+    Derives one sampling seed per window from the base seed and the window's symbol and timestamp, so that a
+    window is forecast with the same random numbers whatever batch it lands in. The base seed is spread over
+    63 bits with a golden-ratio multiplier, so that every seed, also one of 2**31 or more, fits in an int64.
+    """
+    return [(seed * 0x9E3779B97F4A7C15 ^ zlib.crc32(f"{symbol}|{timestamp}".encode())) & (2 ** 63 - 1)
+            for symbol, timestamp in zip(symbols, timestamps)]
+
+
 def generate_predictions(config: dict, test_data: dict) -> dict[str, pd.DataFrame]:
     """
     Runs inference on the test dataset to generate prediction signals.
@@ -264,11 +275,22 @@ def generate_predictions(config: dict, test_data: dict) -> dict[str, pd.DataFram
     results = defaultdict(list)
     with torch.no_grad():
         for x, x_stamp, y_stamp, symbols, timestamps in tqdm(loader, desc="Inference"):
-            preds = auto_regressive_inference(
-                tokenizer, model, x.to(device), x_stamp.to(device), y_stamp.to(device),
-                max_context=config['max_context'], pred_len=config['pred_len'], clip=config['clip'],
-                T=config['T'], top_k=config['top_k'], top_p=config['top_p'], sample_count=config['sample_count']
-            )
+            seed = window_seeds(config['seed'], symbols, timestamps) if config['seed'] is not None else None
+            if config['sample_tolerance'] is None:
+                preds = auto_regressive_inference(
+                    tokenizer, model, x.to(device), x_stamp.to(device), y_stamp.to(device),
+                    max_context=config['max_context'], pred_len=config['pred_len'], clip=config['clip'],
+                    T=config['T'], top_k=config['top_k'], top_p=config['top_p'], sample_count=config['sample_count'],
+                    seed=seed
+                )
+            else:
+                # Only the predicted steps are returned here
+                preds, _ = auto_regressive_adaptive(
+                    tokenizer, model, x.to(device), x_stamp.to(device), y_stamp.to(device),
+                    max_context=config['max_context'], pred_len=config['pred_len'], clip=config['clip'],
+                    T=config['T'], top_k=config['top_k'], top_p=config['top_p'], sample_count=config['sample_count'],
+                    tolerance=config['sample_tolerance'], seed=seed
+                )
             # You can try commenting on this line to keep the history data
             preds = preds[:, -config['pred_len']:, :]
 
@@ -323,6 +345,8 @@ def main():
         'top_k': base_config.inference_top_k,
         'top_p': base_config.inference_top_p,
         'sample_count': base_config.inference_sample_count,
+        'sample_tolerance': base_config.inference_sample_tolerance,
+        'seed': base_config.inference_seed,
         'batch_size': base_config.backtest_batch_size,
     }
 
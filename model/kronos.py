@@ -1,10 +1,16 @@
+import asyncio
+import collections
+import copy
+import os
+import queue
+import threading
 import numpy as np
 import pandas as pd
 import torch
 from huggingface_hub import PyTorchModelHubMixin
 import sys
 
-from tqdm import trange
+from tqdm import trange, tqdm
 
 sys.path.append("../")
 from model.module import *
@@ -71,6 +77,9 @@ class KronosTokenizer(nn.Module, PyTorchModelHubMixin):
         self.post_quant_embed = nn.Linear(in_features=self.codebook_dim, out_features=self.d_model) # Linear layer after quantization (full codebook)
         self.tokenizer = BSQuantizer(self.s1_bits, self.s2_bits, beta, gamma0, gamma, zeta, group_size) # BSQuantizer module
 
+        self.register_buffer('bit_mask', 2 ** torch.arange(self.codebook_dim, dtype=torch.long), persistent=False) # Masks for bit extraction in indices_to_bits
+        self.q_scale = 1. / (self.codebook_dim ** 0.5) # Scaling factor of the quantized codes
+
     def forward(self, x):
         """
         Forward pass of the KronosTokenizer.
@@ -126,53 +135,124 @@ class KronosTokenizer(nn.Module, PyTorchModelHubMixin):
         if half:
             x1 = x[0] # Assuming x is a tuple of indices if half is True
             x2 = x[1]
-            mask = 2 ** torch.arange(self.codebook_dim//2, device=x1.device, dtype=torch.long) # Create a mask for bit extraction
+            mask = self.bit_mask[:self.codebook_dim//2]
             x1 = (x1.unsqueeze(-1) & mask) != 0 # Extract bits for the first half
             x2 = (x2.unsqueeze(-1) & mask) != 0 # Extract bits for the second half
             x = torch.cat([x1, x2], dim=-1) # Concatenate the bit representations
         else:
-            mask = 2 ** torch.arange(self.codebook_dim, device=x.device, dtype=torch.long) # Create a mask for bit extraction
-            x = (x.unsqueeze(-1) & mask) != 0 # Extract bits
+            x = (x.unsqueeze(-1) & self.bit_mask) != 0 # Extract bits
 
-        x = x.float() * 2 - 1 # Convert boolean to bipolar (-1, 1)
-        q_scale = 1. / (self.codebook_dim ** 0.5) # Scaling factor
-        x = x * q_scale
-        return x
+        # Bipolar (-1, 1) codes scaled by q_scale
+        return torch.where(x, self.q_scale, -self.q_scale)
 
-    def encode(self, x, half=False):
+    def encode(self, x, half=False, padding_mask=None):
         """
         Encodes the input data into quantized indices.
 
+        Only the indices are needed here, so the BSQuantizer losses are skipped (see `BSQuantizer.encode_indices`).
+
         Args:
             x (torch.Tensor): Input tensor of shape (batch_size, seq_len, d_in).
             half (bool, optional): Whether to use half quantization in BSQuantizer. Defaults to False.
+            padding_mask (torch.Tensor, optional): Mask for padding positions (True = padding), e.g. the left padding
+                                                   of shorter series in a batch. Shape: [batch_size, seq_len]. Defaults to None.
 
         Returns:
             torch.Tensor: Quantized indices from BSQuantizer.
         """
         z = self.embed(x)
         for layer in self.encoder:
-            z = layer(z)
-        z = self.quant_embed(z)
+            z = layer(z, key_padding_mask=padding_mask)
+        # The indices are the signs of this projection, so it runs in fp32 even under autocast
+        # (see `half_precision`).
+        with torch.autocast(z.device.type, enabled=False):
+            z = self.quant_embed(z.float())
+
+        return self.tokenizer.encode_indices(z, half)
+
+    def new_kv_cache(self, max_len=None, capacity=None):
+        """
+        Creates an empty key/value cache for incremental decoding with `decode`.
+
+        Args:
+            max_len (int, optional): If given, the caches keep a rolling window of the last max_len positions.
+                                     Defaults to None (unbounded).
+            capacity (int, optional): Number of positions to preallocate. Defaults to None (grow as needed,
+                                      or max_len if given).
+
+        Returns:
+            list: One KVCache per decoder Transformer block.
+        """
+        return [KVCache(max_len, capacity) for _ in range(len(self.decoder))]
 
-        bsq_loss, quantized, z_indices = self.tokenizer(z, half)
-        return z_indices
+    def merge_kv_caches(self, caches):
+        """
+        Concatenates the batch rows of several prefilled caches from `new_kv_cache` into one, right-aligning the
+        cached positions (see `KVCache.merge`), so that sequences prefilled separately can be decoded together.
+        """
+        return [KVCache.merge([cache[i] for cache in caches], layer.self_attn.rotary) for i, layer in enumerate(self.decoder)]
 
-    def decode(self, x, half=False):
+    def quantize_dynamic(self):
+        """
+        Returns a copy of the tokenizer for CPU inference in which every nn.Linear layer uses int8 dynamic
+        quantization: int8 weights, with activations quantized on the fly per batch.
+
+        Returns:
+            KronosTokenizer: The quantized copy, in eval mode. The tokenizer itself is left unchanged.
+        """
+        return torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8).eval()
+
+    def half_precision(self, dtype=torch.bfloat16):
+        """
+        Casts the weights to a reduced precision dtype in place, for inference under torch.autocast.
+        quant_embed stays in fp32: its output signs are the BSQ bits, which `encode` computes in fp32.
+
+        Args:
+            dtype (torch.dtype, optional): torch.bfloat16 or torch.float16. Defaults to torch.bfloat16.
+
+        Returns:
+            KronosTokenizer: self.
+        """
+        return cast_parameters(self, dtype, keep=('quant_embed.',))
+
+    @classmethod
+    def _load_as_safetensor(cls, model, model_file, map_location, strict):
+        # Keeps the stored dtype, so that half precision checkpoints (examples/convert_half_precision.py) load as such.
+        return super()._load_as_safetensor(cast_parameters_to_checkpoint(model, model_file), model_file, map_location, strict)
+
+    def fuse_for_inference(self):
+        """
+        Fuses the tokenizer in place for inference: merged q/k/v and w1/w3 projections, the fused RMSNorm kernel
+        and no Dropout modules (see `model.module.fuse_for_inference`). The state_dict changes accordingly, so
+        this is applied after loading and the tokenizer should no longer be trained or saved.
+
+        Returns:
+            KronosTokenizer: self, in eval mode.
+        """
+        return fuse_for_inference(self)
+
+    def decode(self, x, half=False, kv_cache=None, padding_mask=None):
         """
         Decodes quantized indices back to the input data space.
 
+        The decoder blocks are causal, so with a `kv_cache` (see `new_kv_cache`) the indices can be decoded
+        incrementally: x then holds only the positions that follow the cached ones, e.g. a single newly
+        generated (s1, s2) pair, and the cache is extended in place.
+
         Args:
             x (torch.Tensor): Quantized indices tensor.
             half (bool, optional): Whether the indices were generated with half quantization. Defaults to False.
+            kv_cache (list, optional): Key/value cache from `new_kv_cache`. Defaults to None.
+            padding_mask (torch.Tensor, optional): Mask for padding positions of x (True = padding). With a kv_cache,
+                                                   the cache keeps the mask of earlier positions. Defaults to None.
 
         Returns:
             torch.Tensor: Reconstructed output tensor of shape (batch_size, seq_len, d_in).
         """
         quantized = self.indices_to_bits(x, half)
         z = self.post_quant_embed(quantized)
-        for layer in self.decoder:
-            z = layer(z)
+        for i, layer in enumerate(self.decoder):
+            z = layer(z, key_padding_mask=padding_mask, kv_cache=kv_cache[i] if kv_cache is not None else None)
         z = self.head(z)
         return z
 
@@ -275,22 +355,105 @@ class Kronos(nn.Module, PyTorchModelHubMixin):
         s2_logits = self.head.cond_forward(x2)
         return s1_logits, s2_logits
 
-    def decode_s1(self, s1_ids, s2_ids, stamp=None, padding_mask=None):
+    def new_kv_cache(self, max_len=None, capacity=None):
+        """
+        Creates an empty key/value cache for incremental decoding with `decode_s1` and `decode_s2`.
+
+        Args:
+            max_len (int, optional): If given, the caches keep a rolling window of the last max_len positions.
+                                     Defaults to None (unbounded).
+            capacity (int, optional): Number of positions to preallocate. Defaults to None (grow as needed,
+                                      or max_len if given).
+
+        Returns:
+            dict: 'transformer' holds one KVCache per Transformer block, 'dep_layer' the KVCache of the dependency-aware layer.
+        """
+        return {
+            'transformer': [KVCache(max_len, capacity) for _ in range(self.n_layers)],
+            'dep_layer': KVCache(max_len, capacity),
+        }
+
+    def merge_kv_caches(self, caches):
+        """
+        Concatenates the batch rows of several prefilled caches from `new_kv_cache` into one, right-aligning the
+        cached positions (see `KVCache.merge`), so that sequences prefilled separately can be decoded together.
+        The dependency-aware layer caches its projections unrotated, so they are only padded.
+        """
+        return {
+            'transformer': [KVCache.merge([cache['transformer'][i] for cache in caches], layer.self_attn.rotary)
+                            for i, layer in enumerate(self.transformer)],
+            'dep_layer': KVCache.merge([cache['dep_layer'] for cache in caches]),
+        }
+
+    def quantize_dynamic(self):
+        """
+        Returns a copy of the model for CPU inference in which the nn.Linear layers of the Transformer blocks
+        (attention and feed-forward), the embedding fusion projection and the output heads use int8 dynamic
+        quantization: int8 weights, with activations quantized on the fly per batch. The remaining layers,
+        including the dependency-aware layer, stay in float.
+
+        Returns:
+            Kronos: The quantized copy, in eval mode. The model itself is left unchanged.
+        """
+        layers = {name for name, module in self.named_modules()
+                  if isinstance(module, nn.Linear) and (name.startswith(('transformer.', 'head.')) or name == 'embedding.fusion_proj')}
+        return torch.ao.quantization.quantize_dynamic(self, layers, dtype=torch.qint8).eval()
+
+    def half_precision(self, dtype=torch.bfloat16):
+        """
+        Casts the weights to a reduced precision dtype in place, for inference under torch.autocast.
+
+        Args:
+            dtype (torch.dtype, optional): torch.bfloat16 or torch.float16. Defaults to torch.bfloat16.
+
+        Returns:
+            Kronos: self.
+        """
+        return cast_parameters(self, dtype)
+
+    @classmethod
+    def _load_as_safetensor(cls, model, model_file, map_location, strict):
+        # Keeps the stored dtype, so that half precision checkpoints (examples/convert_half_precision.py) load as such.
+        return super()._load_as_safetensor(cast_parameters_to_checkpoint(model, model_file), model_file, map_location, strict)
+
+    def fuse_for_inference(self):
+        """
+        Fuses the model in place for inference: merged q/k/v and w1/w3 projections, embedding tables with the
+        fusion projection folded in, the fused RMSNorm kernel and no Dropout modules
+        (see `model.module.fuse_for_inference`). The state_dict changes accordingly, so
+        this is applied after loading and the model should no longer be trained or saved.
+
+        Returns:
+            Kronos: self, in eval mode.
+        """
+        return fuse_for_inference(self)
+
+    def decode_s1(self, s1_ids, s2_ids, stamp=None, padding_mask=None, kv_cache=None, last_only=False):
         """
         Decodes only the s1 tokens.
 
         This method performs a forward pass to predict only s1 tokens. It returns the s1 logits
         and the context representation from the Transformer, which can be used for subsequent s2 decoding.
 
+        With a `kv_cache` (see `new_kv_cache`), the inputs hold only the positions that follow the cached ones,
+        and the cache is extended in place, including the dependency-aware layer's projections of the returned
+        context. A single prefill over the context followed by one call per
+        generated token then gives the same logits as re-running the full sequence. padding_mask then covers
+        the new positions only; the cache keeps the mask of the earlier ones.
+
         Args:
             s1_ids (torch.Tensor): Input tensor of s1 token IDs. Shape: [batch_size, seq_len]
             s2_ids (torch.Tensor): Input tensor of s2 token IDs. Shape: [batch_size, seq_len]
             stamp (torch.Tensor, optional): Temporal stamp tensor. Shape: [batch_size, seq_len]. Defaults to None.
             padding_mask (torch.Tensor, optional): Mask for padding tokens. Shape: [batch_size, seq_len]. Defaults to None.
+            kv_cache (dict, optional): Key/value cache from `new_kv_cache`. Defaults to None.
+            last_only (bool, optional): Whether to project only the final position through the s1 head, as needed
+                                        during generation. Defaults to False.
 
         Returns:
             Tuple[torch.Tensor, torch.Tensor]:
                 - s1 logits: Logits for s1 token predictions. Shape: [batch_size, seq_len, s1_vocab_size]
+                             ([batch_size, 1, s1_vocab_size] if last_only)
                 - context: Context representation from the Transformer. Shape: [batch_size, seq_len, d_model]
         """
         x = self.embedding([s1_ids, s2_ids])
@@ -299,15 +462,18 @@ class Kronos(nn.Module, PyTorchModelHubMixin):
             x = x + time_embedding
         x = self.token_drop(x)
 
-        for layer in self.transformer:
-            x = layer(x, key_padding_mask=padding_mask)
+        for i, layer in enumerate(self.transformer):
+            layer_cache = kv_cache['transformer'][i] if kv_cache is not None else None
+            x = layer(x, key_padding_mask=padding_mask, kv_cache=layer_cache)
 
         x = self.norm(x)
+        if kv_cache is not None:
+            self.dep_layer.extend_cache(x, kv_cache['dep_layer'], padding_mask)
 
-        s1_logits = self.head(x)
+        s1_logits = self.head(x[:, -1:, :] if last_only else x)
         return s1_logits, x
 
-    def decode_s2(self, context, s1_ids, padding_mask=None):
+    def decode_s2(self, context, s1_ids, padding_mask=None, kv_cache=None, last_only=False):
         """
         Decodes the s2 tokens, conditioned on the context and s1 tokens.
 
@@ -318,13 +484,24 @@ class Kronos(nn.Module, PyTorchModelHubMixin):
             context (torch.Tensor): Context representation from the transformer (output of decode_s1).
                                      Shape: [batch_size, seq_len, d_model]
             s1_ids (torch.torch.Tensor): Input tensor of s1 token IDs. Shape: [batch_size, seq_len]
-            padding_mask (torch.Tensor, optional): Mask for padding tokens. Shape: [batch_size, seq_len]. Defaults to None.
+            padding_mask (torch.Tensor, optional): Mask for padding tokens. Shape: [batch_size, seq_len]. Ignored with a
+                                                   kv_cache, which holds the mask passed to `decode_s1`. Defaults to None.
+            kv_cache (dict, optional): Key/value cache passed to `decode_s1`, which already holds the projections of the
+                                       whole context for the dependency-aware layer. context then holds the last
+                                       seq_len cached positions, and position i only attends to the cache up to
+                                       its own position. Defaults to None.
+            last_only (bool, optional): Whether to evaluate the sibling embedding, the dependency-aware layer and the
+                                        s2 head only for the final position. The full context is still attended to.
+                                        Defaults to False.
 
         Returns:
-            torch.Tensor: s2 logits. Shape: [batch_size, seq_len, s2_vocab_size]
+            torch.Tensor: s2 logits. Shape: [batch_size, seq_len, s2_vocab_size] ([batch_size, 1, s2_vocab_size] if last_only)
         """
+        if last_only:
+            s1_ids = s1_ids[:, -1:]
         sibling_embed = self.embedding.emb_s1(s1_ids)
-        x2 = self.dep_layer(context, sibling_embed, key_padding_mask=padding_mask)
+        dep_cache = kv_cache['dep_layer'] if kv_cache is not None else None
+        x2 = self.dep_layer(context, sibling_embed, key_padding_mask=padding_mask, kv_cache=dep_cache, last_only=last_only)
         return self.head.cond_forward(x2)
 
 
@@ -342,8 +519,13 @@ def top_k_top_p_filtering(
         if top_p < 1.0: keep the top tokens with cumulative probability >= top_p (nucleus filtering).
             Nucleus filtering is described in Holtzman et al. (http://arxiv.org/abs/1904.09751)
         Make sure we keep at least min_tokens_to_keep per batch example in the output
+        top_k and top_p may also be tensors of shape (batch size,) holding one value per row; as with scalars,
+        rows with top_k > 0 are only top-k filtered.
     From: https://gist.github.com/thomwolf/1a5a29f6962089e871b94cbd09daf317
     """
+    if torch.is_tensor(top_k) or torch.is_tensor(top_p):
+        return _top_k_top_p_filtering_per_row(logits, top_k, top_p, filter_value, min_tokens_to_keep)
+
     if top_k > 0:
         top_k = min(max(top_k, min_tokens_to_keep), logits.size(-1))  # Safety check
         # Remove all tokens with a probability less than the last token of the top-k
@@ -370,77 +552,766 @@ def top_k_top_p_filtering(
         return logits
 
 
-def sample_from_logits(logits, temperature=1.0, top_k=None, top_p=None, sample_logits=True):
-    logits = logits / temperature
-    if top_k is not None or top_p is not None:
-        if top_k > 0 or top_p < 1.0:
-            logits = top_k_top_p_filtering(logits, top_k=top_k, top_p=top_p)
+def _top_k_top_p_filtering_per_row(logits, top_k, top_p, filter_value, min_tokens_to_keep):
+    """Vectorized `top_k_top_p_filtering` for per-row top_k/top_p (scalars are broadcast to every row)."""
+    batch_size, vocab_size = logits.shape
+    top_k = torch.as_tensor(top_k, device=logits.device).expand(batch_size)
+    top_p = torch.as_tensor(top_p, device=logits.device, dtype=logits.dtype).expand(batch_size)
+    use_top_k = top_k > 0
+    use_top_p = ~use_top_k & (top_p < 1.0)
 
-    probs = F.softmax(logits, dim=-1)
+    sorted_logits, sorted_indices = torch.sort(logits, descending=True)
 
-    if not sample_logits:
-        _, x = top_k(probs, k=1, dim=-1)
-    else:
-        x = torch.multinomial(probs, num_samples=1)
+    # Top-k: remove everything below the k-th largest logit of the row
+    k = top_k.clamp(min=min_tokens_to_keep, max=vocab_size)
+    kth_logits = sorted_logits.gather(-1, (k - 1).unsqueeze(-1))
+    indices_to_remove = use_top_k.unsqueeze(-1) & (logits < kth_logits)
+
+    # Top-p: same shifted cumulative probability rule as the scalar path
+    cumulative_probs = torch.cumsum(F.softmax(sorted_logits, dim=-1), dim=-1)
+    sorted_indices_to_remove = cumulative_probs > top_p.unsqueeze(-1)
+    if min_tokens_to_keep > 1:
+        sorted_indices_to_remove[..., :min_tokens_to_keep] = 0
+    sorted_indices_to_remove[..., 1:] = sorted_indices_to_remove[..., :-1].clone()
+    sorted_indices_to_remove[..., 0] = 0
+    sorted_indices_to_remove &= use_top_p.unsqueeze(-1)
+    indices_to_remove |= sorted_indices_to_remove.scatter(1, sorted_indices, sorted_indices_to_remove)
+
+    return logits.masked_fill(indices_to_remove, filter_value)
+
+
+def sample_top_k_top_p(logits, top_k=0, top_p=1.0, uniforms=None, max_candidates=64):
+    """
+    Samples one token per row of logits (batch size, vocabulary size) from the same distribution as
+    `top_k_top_p_filtering` followed by softmax and `torch.multinomial`, without sorting the whole vocabulary.
+
+    Only the max_candidates most likely tokens of every row are selected (partial top-k); rows whose kept set
+    is not contained in them fall back to a full sort. The token is then drawn by inverse-CDF sampling from
+    `uniforms`, one U[0, 1) value per row, which are drawn here if not given.
 
+    Args:
+        logits (torch.Tensor): Logits of shape (batch size, vocabulary size).
+        top_k (int or torch.Tensor): Top-k threshold, scalar or one per row. Rows with top_k > 0 are only top-k filtered.
+        top_p (float or torch.Tensor): Nucleus threshold, scalar or one per row.
+        uniforms (torch.Tensor, optional): Pre-drawn uniforms of shape (batch size,). Defaults to None.
+        max_candidates (int, optional): Number of most likely tokens selected before falling back to a full sort.
+
+    Returns:
+        torch.Tensor: Sampled token ids of shape (batch size, 1).
+    """
+    batch_size, vocab_size = logits.shape
+    device = logits.device
+    top_k = torch.as_tensor(0 if top_k is None else top_k, device=device).expand(batch_size)
+    top_p = torch.as_tensor(1.0 if top_p is None else top_p, device=device, dtype=torch.float32).expand(batch_size)
+    if uniforms is None:
+        uniforms = torch.rand(batch_size, device=device)
+    probs = F.softmax(logits.float(), dim=-1)
+
+    num_candidates = min(max_candidates, vocab_size)
+    candidate_probs, candidate_ids = torch.topk(probs, num_candidates)
+    tokens, covered = _sample_sorted(candidate_probs, candidate_ids, top_k, top_p, uniforms, complete=num_candidates == vocab_size)
+    if not covered.all():
+        rows = (~covered).nonzero().squeeze(-1)
+        sorted_probs, sorted_ids = torch.sort(probs[rows], descending=True)
+        tokens[rows], _ = _sample_sorted(sorted_probs, sorted_ids, top_k[rows], top_p[rows], uniforms[rows], complete=True)
+    return tokens.unsqueeze(-1)
+
+
+def _sample_sorted(sorted_probs, sorted_ids, top_k, top_p, uniforms, complete):
+    """
+    Inverse-CDF step of `sample_top_k_top_p` on each row's most likely tokens, sorted by descending probability.
+    Also returns which rows have their whole kept set among these tokens (every row if complete).
+    """
+    cumulative = sorted_probs.cumsum(-1)
+    # Top-k keeps every token at least as likely as the k-th one (ties included, like `logits < kth` removal),
+    # top-p every token up to and including the first whose cumulative probability exceeds top_p.
+    kth_probs = sorted_probs.gather(-1, (top_k.clamp(1, sorted_probs.size(-1)) - 1).unsqueeze(-1))
+    keep_top_k = sorted_probs >= kth_probs
+    exclusive = F.pad(cumulative[..., :-1], (1, 0))
+    keep_top_p = (exclusive <= top_p.unsqueeze(-1)) | (top_p >= 1.0).unsqueeze(-1)
+    keep = torch.where((top_k > 0).unsqueeze(-1), keep_top_k, keep_top_p)  # a prefix of every row
+
+    num_kept = keep.sum(-1, keepdim=True)
+    covered = torch.ones_like(keep[:, -1]) if complete else ~keep[:, -1]
+    target = uniforms.unsqueeze(-1) * cumulative.gather(-1, num_kept - 1)
+    index = torch.minimum(torch.searchsorted(cumulative, target, right=True), num_kept - 1)
+    return sorted_ids.gather(-1, index).squeeze(-1), covered
+
+
+def sample_from_logits(logits, temperature=1.0, top_k=None, top_p=None, sample_logits=True, uniforms=None):
+    """
+    Samples one token per row of logits (batch size, vocabulary size). temperature, top_k and top_p are either
+    scalars or tensors of shape (batch size,) with one value per row, so rows with different sampling settings
+    can share a batch. Sampling goes through `sample_top_k_top_p`, optionally with pre-drawn `uniforms`.
+    """
+    if torch.is_tensor(temperature):
+        temperature = temperature.to(logits.device, torch.float32).unsqueeze(-1)
+    logits = logits.float() / temperature  # the filtering and softmax run in fp32, also for half precision logits
+    if sample_logits:
+        return sample_top_k_top_p(logits, top_k, top_p, uniforms)
+
+    # Greedy decoding: the most likely token survives any top-k/top-p filtering
+    _, x = torch.topk(logits, k=1, dim=-1)
     return x
 
 
-def auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99, sample_count=5, verbose=False):
-    with torch.no_grad():
-        batch_size = x.size(0)
-        initial_seq_len = x.size(1)
-        x = torch.clip(x, -clip, clip)
+def _pcg_hash(x):
+    """PCG-style integer hash of 32-bit values held in an int64 tensor (no intermediate overflows int64)."""
+    x = (x * 747796405 + 2891336453) & 0xFFFFFFFF
+    word = (((x >> ((x >> 28) + 4)) ^ x) * 277803737) & 0xFFFFFFFF
+    return (word >> 22) ^ word
 
-        device = x.device
-        x = x.unsqueeze(1).repeat(1, sample_count, 1, 1).reshape(-1, x.size(1), x.size(2)).to(device)
-        x_stamp = x_stamp.unsqueeze(1).repeat(1, sample_count, 1, 1).reshape(-1, x_stamp.size(1), x_stamp.size(2)).to(device)
-        y_stamp = y_stamp.unsqueeze(1).repeat(1, sample_count, 1, 1).reshape(-1, y_stamp.size(1), y_stamp.size(2)).to(device)
 
-        x_token = tokenizer.encode(x, half=True)
+def counter_uniforms(seeds, samples, step, count=2):
+    """
+    Counter-based U(0, 1) numbers: a hash of (seed, sample index, step, k) for k < count, returned with shape
+    (count, rows) for int64 tensors seeds and samples of shape (rows,). Unlike a stateful generator, the value
+    of a row depends on nothing but its own counters, so a seeded trajectory comes out the same regardless of
+    which other rows share the batch, or of the order in which the rows are sampled.
+    """
+    h = _pcg_hash(seeds & 0xFFFFFFFF)
+    h = _pcg_hash(h ^ ((seeds >> 32) & 0xFFFFFFFF))
+    h = _pcg_hash(h ^ (samples & 0xFFFFFFFF))
+    h = torch.stack([_pcg_hash(_pcg_hash(h ^ (step & 0xFFFFFFFF)) ^ k) for k in range(count)])
+    return ((h >> 8).float() + 0.5) / 2 ** 24  # 24 bits, exactly representable and strictly inside (0, 1)
 
-        def get_dynamic_stamp(x_stamp, y_stamp, current_seq_len, pred_step):
 
-            if current_seq_len <= max_context - pred_step:
-                return torch.cat([x_stamp, y_stamp[:, :pred_step, :]], dim=1)
+def _series_rows(value, batch_size, sample_count, device):
+    """
+    Expands a per-series parameter (a sequence, array or tensor of length batch_size) to one value per
+    sampled row, i.e. a tensor of shape [batch_size * sample_count]. Scalars are returned unchanged.
+    """
+    if not torch.is_tensor(value) and np.ndim(value) == 0:
+        return value
+    value = torch.as_tensor(value, device=device)
+    if value.dim() == 0:
+        return value
+    if value.shape != (batch_size,):
+        raise ValueError(f"Per-series parameters need one value per series ({batch_size}), got shape {tuple(value.shape)}.")
+    return value.repeat_interleave(sample_count)
+
+
+@torch.no_grad()
+def auto_regressive_stream(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99, sample_count=5, verbose=False,
+                           rolling_cache=False, padding_mask=None, seed=None, sample_offset=0):
+    """
+    Generator form of `auto_regressive_inference` that yields the sequence chunk by chunk as it is produced.
+
+    The first chunk covers the context (its last max_context positions), followed by one chunk per generated
+    step. Each chunk is a tuple (tokens, z): tokens is [s1_ids, s2_ids], each of shape
+    [batch_size * sample_count, chunk_len], and z holds the decoded, still normalized rows of shape
+    [batch_size * sample_count, chunk_len, d_in]. Row b * sample_count + j is sample j of series b.
+
+    Generated rows are decoded incrementally with a tokenizer KV cache bounded to max_context. Past max_context
+    without rolling_cache, they can therefore differ slightly from `auto_regressive_inference`, which re-decodes
+    the final window from scratch in that case.
+
+    T, top_k and top_p are scalars or hold one value per series (length batch_size), see `sample_from_logits`.
+
+    Series with different history lengths are batched by left-padding x and x_stamp to a common length, with
+    padding_mask ([batch_size, seq_len], True for padding) marking the padded positions, which are NaN in z.
+    pred_len can likewise hold one horizon per series, with y_stamp covering the longest: a series whose
+    horizon has been reached is retired from the batch, and its rows of the later chunks hold token 0 and NaN.
+
+    By default the tokens are sampled with the global torch RNG. With a seed (an int, or one per series), sample
+    j of a series instead draws `counter_uniforms` of (seed, sample_offset + j, step), so that the same inputs and
+    seed give the same trajectory whether the series is forecast alone or batched with others (up to the
+    floating point differences of batched kernels). A shared int seed gives every series the same random
+    numbers; pass one seed per series for independent streams. sample_offset numbers the samples of a later
+    chunk of paths after those of earlier chunks.
+    """
+    batch_size = x.size(0)
+    initial_seq_len = x.size(1)
+    x = torch.clip(x, -clip, clip)
+
+    device = x.device
+    x_stamp = x_stamp.to(device)
+    y_stamp = y_stamp.to(device)
+    T, top_k, top_p, horizons = (_series_rows(v, batch_size, sample_count, device) for v in (T, top_k, top_p, pred_len))
+    pred_len = int(horizons.max()) if torch.is_tensor(horizons) else horizons
+    if seed is not None:
+        seeds = torch.as_tensor(seed, dtype=torch.long, device=device)
+        seeds = seeds.expand(batch_size).repeat_interleave(sample_count) if seeds.dim() == 0 else _series_rows(seeds, batch_size, sample_count, device)
+        samples = torch.arange(sample_offset, sample_offset + sample_count, device=device).repeat(batch_size)
+    if (horizons.min() if torch.is_tensor(horizons) else horizons) < 1:
+        raise ValueError("pred_len must be at least 1 for every series.")
+    if padding_mask is not None:
+        padding_mask = padding_mask.to(device).bool()
+
+    # The context is identical for all sample replicas until the first sampled token, so it is
+    # tokenized and prefilled once per series and the resulting state is broadcast afterwards.
+    x_token = tokenizer.encode(x, half=True, padding_mask=padding_mask)
+
+    # Every cache holds at most max_context positions: without rolling_cache the model caches are
+    # only used while the sequence fits in max_context, the tokenizer decoder cache always rolls.
+    prefix_len = min(initial_seq_len, max_context)
+    capacity = min(prefix_len + pred_len, max_context)
+
+    kv_cache = model.new_kv_cache(max_context if rolling_cache else None, capacity)
+    prefix_tokens = [t[:, -max_context:] for t in x_token]
+    prefix_mask = padding_mask[:, -max_context:] if padding_mask is not None else None
+    s1_logits, context = model.decode_s1(prefix_tokens[0], prefix_tokens[1], x_stamp[:, -max_context:, :], padding_mask=prefix_mask,
+                                         kv_cache=kv_cache, last_only=True)
+
+    # The tokenizer decoder is causal as well, so generated tokens are decoded one step at a time on top
+    # of the decoded context.
+    decoder_cache = tokenizer.new_kv_cache(max_context, capacity)
+    z_history = tokenizer.decode(prefix_tokens, half=True, kv_cache=decoder_cache, padding_mask=prefix_mask)
+    if prefix_mask is not None:
+        z_history = z_history.masked_fill(prefix_mask.unsqueeze(-1), float('nan'))
+
+    for cache in kv_cache['transformer'] + [kv_cache['dep_layer']] + decoder_cache:
+        cache.repeat_interleave(sample_count)
+    s1_logits = s1_logits.repeat_interleave(sample_count, dim=0)
+    context = context[:, -1:, :].repeat_interleave(sample_count, dim=0)
+
+    # Fixed-size token and stamp buffers for the whole sequence; step i writes position initial_seq_len + i.
+    total_len = initial_seq_len + pred_len
+    num_rows = batch_size * sample_count
+    token_buffer = [torch.empty(num_rows, total_len, dtype=t.dtype, device=device) for t in x_token]
+    for buffer, t in zip(token_buffer, x_token):
+        buffer[:, :initial_seq_len] = t.repeat_interleave(sample_count, dim=0)
+    stamp_buffer = torch.cat([x_stamp, y_stamp[:, :pred_len]], dim=1).repeat_interleave(sample_count, dim=0)
+    mask_buffer = F.pad(padding_mask, (0, pred_len)).repeat_interleave(sample_count, dim=0) if padding_mask is not None else None
+
+    yield [t[:, initial_seq_len - prefix_len:initial_seq_len] for t in token_buffer], z_history.repeat_interleave(sample_count, dim=0)
+
+    if verbose:
+        ran = trange
+    else:
+        ran = range
+    rows = None  # indices of the remaining rows once a series has been retired
+    window_mask = None
+    for i in ran(pred_len):
+        current_seq_len = initial_seq_len + i
+
+        if i > 0:
+            if current_seq_len <= max_context or rolling_cache:
+                window_start = current_seq_len - 1
             else:
-                start_idx = max_context - pred_step
-                return torch.cat([x_stamp[:, -start_idx:, :], y_stamp[:, :pred_step, :]], dim=1)
-
-        if verbose:
-            ran = trange
+                kv_cache = None
+                window_start = current_seq_len - max_context
+                window_mask = mask_buffer[:, window_start:current_seq_len] if mask_buffer is not None else None
+            input_tokens = [t[:, window_start:current_seq_len] for t in token_buffer]
+            current_stamp = stamp_buffer[:, window_start:current_seq_len]
+            s1_logits, context = model.decode_s1(input_tokens[0], input_tokens[1], current_stamp, padding_mask=window_mask, kv_cache=kv_cache,
+                                                 last_only=True)
+
+        # One uniform per row for each of the two sampled sub-tokens, drawn at once.
+        if seed is None:
+            uniforms = torch.rand(2, s1_logits.size(0), device=device)
         else:
-            ran = range
-        for i in ran(pred_len):
-            current_seq_len = initial_seq_len + i
+            uniforms = counter_uniforms(seeds, samples, i)
+        s1_logits = s1_logits[:, -1, :]
+        sample_pre = sample_from_logits(s1_logits, temperature=T, top_k=top_k, top_p=top_p, sample_logits=True, uniforms=uniforms[0])
+
+        s2_logits = model.decode_s2(context, sample_pre, padding_mask=window_mask, kv_cache=kv_cache, last_only=True)
+        s2_logits = s2_logits[:, -1, :]
+        sample_post = sample_from_logits(s2_logits, temperature=T, top_k=top_k, top_p=top_p, sample_logits=True, uniforms=uniforms[1])
+
+        token_buffer[0][:, current_seq_len:current_seq_len + 1] = sample_pre
+        token_buffer[1][:, current_seq_len:current_seq_len + 1] = sample_post
+
+        tokens = [sample_pre, sample_post]
+        z = tokenizer.decode(tokens, half=True, kv_cache=decoder_cache)
+        if rows is not None:
+            tokens = [t.new_zeros(num_rows, 1).index_copy_(0, rows, t) for t in tokens]
+            z = z.new_full((num_rows,) + z.shape[1:], float('nan')).index_copy_(0, rows, z)
+        yield tokens, z
+
+        if torch.is_tensor(horizons) and i + 1 < pred_len and bool((horizons == i + 1).any()):
+            # Retire the series whose horizon has been reached from every buffer and cache
+            keep = (horizons > i + 1).nonzero().squeeze(-1)
+            rows = keep if rows is None else rows.index_select(0, keep)
+            horizons = horizons.index_select(0, keep)
+            T, top_k, top_p = (v.index_select(0, keep) if torch.is_tensor(v) and v.dim() else v for v in (T, top_k, top_p))
+            if seed is not None:
+                seeds, samples = seeds.index_select(0, keep), samples.index_select(0, keep)
+            token_buffer = [t.index_select(0, keep) for t in token_buffer]
+            stamp_buffer = stamp_buffer.index_select(0, keep)
+            if mask_buffer is not None:
+                mask_buffer = mask_buffer.index_select(0, keep)
+            caches = list(decoder_cache)
+            if kv_cache is not None:
+                caches += list(kv_cache['transformer']) + [kv_cache['dep_layer']]
+            for cache in caches:
+                cache.select(keep)
+
+
+def _sample_paths(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip, T, top_k, top_p, sample_count, verbose, rolling_cache,
+                  padding_mask, seed=None, sample_offset=0):
+    """
+    Runs `auto_regressive_stream` and returns the decoded sample paths of shape
+    [batch_size, sample_count, window, d_in] on the model device, with the final window re-decoded from scratch
+    where `auto_regressive_inference` requires it.
+    """
+    batch_size = x.size(0)
+    s1_chunks, s2_chunks, z_chunks = [], [], []
+    for tokens, z in auto_regressive_stream(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip, T, top_k, top_p, sample_count, verbose,
+                                            rolling_cache=rolling_cache, padding_mask=padding_mask, seed=seed, sample_offset=sample_offset):
+        s1_chunks.append(tokens[0])
+        s2_chunks.append(tokens[1])
+        z_chunks.append(z)
+
+    horizons = torch.as_tensor(pred_len).expand(batch_size).tolist()
+    max_pred_len = max(horizons)
+    z = torch.cat(z_chunks, dim=1)[:, -max_context:]
+    if not (x.size(1) + max_pred_len <= max_context or rolling_cache):
+        # Re-decode the final max_context window of every series from scratch, one group of series per horizon.
+        prefix_len = s1_chunks[0].size(1)
+        total_len = prefix_len + max_pred_len
+        s1_ids, s2_ids = torch.cat(s1_chunks, dim=1), torch.cat(s2_chunks, dim=1)
+        mask = None
+        if padding_mask is not None:
+            mask = F.pad(padding_mask[:, -max_context:].to(z.device).bool(), (0, max_pred_len)).repeat_interleave(sample_count, dim=0)
+        for horizon in sorted(set(horizons)):
+            end = prefix_len + horizon
+            if end <= max_context:
+                continue  # this series never outgrew max_context, so its incremental decoding is exact
+            series = torch.tensor([b for b in range(batch_size) if horizons[b] == horizon], device=z.device)
+            group = (series[:, None] * sample_count + torch.arange(sample_count, device=z.device)).flatten()
+            window = slice(end - max_context, end)
+            with torch.no_grad():
+                z_group = tokenizer.decode([s1_ids[group, window], s2_ids[group, window]], half=True,
+                                           padding_mask=mask[group, window] if mask is not None else None)
+            if mask is not None:
+                z_group = z_group.masked_fill(mask[group, window].unsqueeze(-1), float('nan'))
+            # z covers the last max_context positions of the longest horizon, [total_len - max_context, total_len)
+            start = max(end - max_context, total_len - max_context)
+            z[group, start - total_len + max_context:end - total_len + max_context] = z_group[:, start - end + max_context:]
+    return z.reshape(batch_size, sample_count, z.size(1), z.size(2))
+
+
+def _sample_path_chunks(sample_count, sample_chunk, *args, **kwargs):
+    """Yields the sample paths of `_sample_paths` in chunks of at most sample_chunk samples per series."""
+    sample_chunk = sample_chunk or sample_count
+    for start in range(0, sample_count, sample_chunk):
+        kwargs['sample_count'] = min(sample_chunk, sample_count - start)
+        yield _sample_paths(*args, sample_offset=start, **kwargs)
+
+
+def auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99, sample_count=5, verbose=False,
+                              rolling_cache=False, padding_mask=None, sample_chunk=None, seed=None):
+    """
+    Samples pred_len future tokens for every series and returns the decoded sequences averaged over sample_count paths.
 
-            if current_seq_len <= max_context:
-                input_tokens = x_token
-            else:
-                input_tokens = [t[:, -max_context:].contiguous() for t in x_token]
+    While the sequence fits in max_context, every step feeds only the newly sampled token through the KV cache.
+    Beyond max_context the model sees a sliding window of the last max_context tokens: by default each step
+    re-encodes that window from scratch, with rolling_cache=True the KV cache instead evicts its oldest
+    positions and keeps the per-step cost constant. The cached keys/values of the remaining positions were
+    computed with the longer history, so rolling_cache is an approximation of the sliding-window recompute
+    (see examples/rolling_cache_accuracy.py).
 
-            current_stamp = get_dynamic_stamp(x_stamp, y_stamp, current_seq_len, i)
+    Left-padded histories (padding_mask) and per-series pred_len are supported as in `auto_regressive_stream`.
+    The returned sequences share the time axis of the longest horizon; positions past a series' own horizon
+    are NaN.
 
-            s1_logits, context = model.decode_s1(input_tokens[0], input_tokens[1], current_stamp)
-            s1_logits = s1_logits[:, -1, :]
-            sample_pre = sample_from_logits(s1_logits, temperature=T, top_k=top_k, top_p=top_p, sample_logits=True)
+    With sample_chunk, at most that many samples per series are decoded at once and the average is accumulated
+    on the device, which bounds the memory of large sample counts.
 
-            s2_logits = model.decode_s2(context, sample_pre)
-            s2_logits = s2_logits[:, -1, :]
-            sample_post = sample_from_logits(s2_logits, temperature=T, top_k=top_k, top_p=top_p, sample_logits=True)
+    With a seed, sampling is deterministic per series and sample, see `auto_regressive_stream`; the result then
+    does not depend on the batch composition or on sample_chunk.
+    """
+    stats = SampleStatistics()
+    for z in _sample_path_chunks(sample_count, sample_chunk, tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip, T, top_k, top_p,
+                                 verbose=verbose, rolling_cache=rolling_cache, padding_mask=padding_mask, seed=seed):
+        stats.update(z)
+    return stats.mean.cpu().numpy()
 
-            x_token[0] = torch.cat([x_token[0], sample_pre], dim=1)
-            x_token[1] = torch.cat([x_token[1], sample_post], dim=1)
 
-            torch.cuda.empty_cache()
+def auto_regressive_statistics(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99, sample_count=5,
+                               verbose=False, rolling_cache=False, padding_mask=None, sample_chunk=64, quantiles=(0.05, 0.5, 0.95), seed=None):
+    """
+    Distribution of the forecast over sample_count paths, aggregated in chunks of sample_chunk samples per series
+    (see `SampleStatistics`), so that no more than one chunk of paths is ever held. Arguments as in
+    `auto_regressive_inference`.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The mean and standard deviation of shape
+            [batch_size, pred_len, d_in] and the estimated quantiles of shape [len(quantiles), batch_size, pred_len, d_in]
+            of the predicted (normalized) steps.
+    """
+    max_pred_len = int(np.max(pred_len))
+    stats = SampleStatistics(quantiles)
+    for z in _sample_path_chunks(sample_count, sample_chunk, tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip, T, top_k, top_p,
+                                 verbose=verbose, rolling_cache=rolling_cache, padding_mask=padding_mask, seed=seed):
+        stats.update(z[:, :, -max_pred_len:])
+    return stats.mean.cpu().numpy(), stats.std.cpu().numpy(), stats.quantiles.cpu().numpy()
 
-        input_tokens = [t[:, -max_context:].contiguous() for t in x_token]
-        z = tokenizer.decode(input_tokens, half=True)
-        z = z.reshape(batch_size, sample_count, z.size(1), z.size(2))
-        preds = z.cpu().numpy()
-        preds = np.mean(preds, axis=1)
 
-        return preds
+def auto_regressive_adaptive(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99, sample_count=64,
+                             verbose=False, rolling_cache=False, padding_mask=None, tolerance=0.05, round_size=8, target=3, seed=None):
+    """
+    Adaptive form of `auto_regressive_inference`: the paths are drawn in rounds of round_size samples per series,
+    and a series stops sampling once the standard error of its mean forecast of feature `target` (3, close, by
+    default) is at most tolerance at every predicted step. Forecasts are normalized, so tolerance is in units
+    of the series' own standard deviation. sample_count is the maximum number of paths per series.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The mean forecast of the predicted steps, [batch_size, pred_len, d_in]
+            (NaN past a series' own horizon), and the number of paths drawn for every series.
+    """
+    batch_size = x.size(0)
+    horizons = torch.as_tensor(pred_len).expand(batch_size).tolist()
+    max_pred_len = max(horizons)
+    stats = SampleStatistics()
+    active = torch.arange(batch_size, device=x.device)
+    drawn = 0
+    while True:
+        rows = active.tolist()
+        series_pred_len = [horizons[b] for b in rows]
+        T_rows, top_k_rows, top_p_rows, seed_rows = (v if v is None or np.ndim(v) == 0 else torch.as_tensor(v, device=x.device)[active]
+                                                     for v in (T, top_k, top_p, seed))
+        n = min(round_size, sample_count - drawn)
+        z = _sample_paths(tokenizer, model, x[active], x_stamp[active], y_stamp[active], max_context,
+                          series_pred_len if len(set(series_pred_len)) > 1 else series_pred_len[0], clip, T_rows, top_k_rows, top_p_rows, n,
+                          verbose, rolling_cache, padding_mask[active] if padding_mask is not None else None, seed=seed_rows, sample_offset=drawn)
+        z = z[:, :, -max(series_pred_len):]
+        z = F.pad(z, (0, 0, 0, max_pred_len - z.size(2)), value=float('nan'))  # steps past the horizons of the whole round
+        stats.update(z, active if drawn else None)
+        drawn += n
+        if drawn >= sample_count:
+            break
+
+        # Steps past a series' own horizon do not hold it back; a single path has no standard error yet
+        error = stats.standard_error[active][:, :, target]
+        past_horizon = torch.arange(max_pred_len, device=x.device) >= torch.tensor(horizons, device=x.device)[active].unsqueeze(-1)
+        converged = ((error <= tolerance) | past_horizon).all(dim=-1) & (stats.count[active] >= 2)
+        active = active[~converged]
+        if active.numel() == 0:
+            break
+    return stats.mean.cpu().numpy(), stats.count.long().cpu().numpy()
+
+
+def _sampling_probs(logits, T, top_k, top_p):
+    """The distribution (rows, vocabulary size) that `sample_from_logits` samples from with the same T, top_k and top_p."""
+    if torch.is_tensor(T):
+        T = T.to(logits.device, torch.float32).unsqueeze(-1)
+    logits = _top_k_top_p_filtering_per_row(logits.float() / T, top_k, top_p, -float("Inf"), 1)
+    return F.softmax(logits, dim=-1)
+
+
+def _residual_sample(p, q):
+    """Samples one token per row from max(0, p - q), renormalized: the distribution of a rejected draft token."""
+    residual = (p - q).clamp(min=0)
+    residual = torch.where(residual.sum(-1, keepdim=True) > 0, residual, p)  # p == q up to rounding
+    return torch.multinomial(residual, 1)
+
+
+def _check_draft_model(tokenizer, model, draft_tokenizer, draft_model):
+    """
+    Raises a ValueError unless draft_model can propose tokens for model: both have to predict the same (s1, s2)
+    vocabulary of the same tokenizer. draft_tokenizer is the tokenizer the draft model was trained with; it has
+    to be identical to tokenizer, e.g. Kronos-mini (Kronos-Tokenizer-2k) cannot draft for Kronos-small
+    (Kronos-Tokenizer-base). Equal bit widths alone do not make token ids of different tokenizers compatible.
+    """
+    if draft_tokenizer is None:
+        raise ValueError("A draft model needs the draft_tokenizer it was trained with, to check that it shares the tokenizer of the model.")
+    if (draft_model.s1_bits, draft_model.s2_bits) != (model.s1_bits, model.s2_bits):
+        raise ValueError(f"The draft model predicts {draft_model.s1_bits}+{draft_model.s2_bits}-bit tokens, "
+                         f"the model {model.s1_bits}+{model.s2_bits}-bit tokens.")
+    if draft_tokenizer is tokenizer:
+        return
+    state, draft_state = tokenizer.state_dict(), draft_tokenizer.state_dict()
+    if state.keys() != draft_state.keys() or not all(
+            state[name].shape == draft_state[name].shape and torch.equal(state[name], draft_state[name].to(state[name].device)) for name in state):
+        raise ValueError("The draft model was trained with a different tokenizer than the model, so their tokens are not compatible.")
+
+
+@torch.no_grad()
+def auto_regressive_speculative(tokenizer, model, draft_tokenizer, draft_model, x, x_stamp, y_stamp, max_context, pred_len, clip=5, T=1.0, top_k=0, top_p=0.99,
+                                sample_count=5, verbose=False, rolling_cache=False, padding_mask=None, draft_steps=4):
+    """
+    Speculative sampling form of `auto_regressive_inference`: the (usually much smaller) draft_model proposes
+    draft_steps tokens one at a time, and model scores all of them in one cached forward pass. Each proposed
+    (s1, s2) pair is accepted with probability min(1, p / q) per sub-token, p and q being the filtered target and
+    draft distributions; the first rejected sub-token is resampled from max(0, p - q) (an s2 after a resampled
+    s1 directly from the model), and the later proposals are discarded. The paths therefore follow the
+    distribution of `auto_regressive_inference` exactly, while model runs one forward pass per accepted run
+    of tokens instead of one per token.
+
+    The rows of a batch advance together by the shortest accepted run, so acceptance matters most with few
+    series and samples. draft_tokenizer, the tokenizer draft_model was trained with, has to be identical to
+    tokenizer (see `_check_draft_model`).
+
+    Both models decode with KV caches while the sequence fits in max_context; the remaining steps are sampled
+    from model alone as in `auto_regressive_stream`. pred_len is a single horizon for all series.
+    """
+    _check_draft_model(tokenizer, model, draft_tokenizer, draft_model)
+    if draft_steps < 1:
+        raise ValueError(f"draft_steps must be at least 1, got {draft_steps}.")
+    if np.ndim(pred_len) != 0 or pred_len < 1:
+        raise ValueError("Speculative sampling needs a single pred_len of at least 1.")
+    batch_size, initial_seq_len = x.shape[:2]
+    x = torch.clip(x, -clip, clip)
+
+    device = x.device
+    x_stamp = x_stamp.to(device)
+    y_stamp = y_stamp.to(device)
+    T, top_k, top_p = (_series_rows(v, batch_size, sample_count, device) for v in (T, top_k, top_p))
+    if padding_mask is not None:
+        padding_mask = padding_mask.to(device).bool()
+    x_token = tokenizer.encode(x, half=True, padding_mask=padding_mask)
+
+    total_len = initial_seq_len + pred_len
+    num_rows = batch_size * sample_count
+    token_buffer = [torch.empty(num_rows, total_len, dtype=t.dtype, device=device) for t in x_token]
+    for buffer, t in zip(token_buffer, x_token):
+        buffer[:, :initial_seq_len] = t.repeat_interleave(sample_count, dim=0)
+    stamp_buffer = torch.cat([x_stamp, y_stamp[:, :pred_len]], dim=1).repeat_interleave(sample_count, dim=0)
+    mask_buffer = F.pad(padding_mask, (0, pred_len)).repeat_interleave(sample_count, dim=0) if padding_mask is not None else None
+
+    # The caches cover the positions from `start` on and hold every committed token but the last one, which is
+    # fed together with the next proposals. Both models prefill the context window accordingly.
+    start = max(initial_seq_len - max_context, 0)
+    caches = []
+    for m in (model, draft_model):
+        cache = m.new_kv_cache(max_context if rolling_cache else None, max_context)
+        if initial_seq_len - start > 1:
+            prefix = slice(start, initial_seq_len - 1)
+            m.decode_s1(x_token[0][:, prefix], x_token[1][:, prefix], x_stamp[:, prefix], padding_mask=padding_mask[:, prefix] if padding_mask is not None else None,
+                        kv_cache=cache, last_only=True)
+            for layer_cache in cache['transformer'] + [cache['dep_layer']]:
+                layer_cache.repeat_interleave(sample_count)
+        caches.append(cache)
+    kv_cache, draft_cache = caches
+
+    # With rolling_cache, a sequence outgrowing max_context is decoded on a rolling tokenizer cache as in
+    # `auto_regressive_inference`; otherwise the final window is decoded from scratch at the end.
+    decoder_cache, z_chunks = None, []
+    if rolling_cache and total_len - start > max_context:
+        decoder_cache = tokenizer.new_kv_cache(max_context, max_context)
+        prefix_mask = padding_mask[:, start:] if padding_mask is not None else None
+        z = tokenizer.decode([t[:, start:] for t in x_token], half=True, kv_cache=decoder_cache, padding_mask=prefix_mask)
+        if prefix_mask is not None:
+            z = z.masked_fill(prefix_mask.unsqueeze(-1), float('nan'))
+        z_chunks.append(z.repeat_interleave(sample_count, dim=0))
+        for layer_cache in decoder_cache:
+            layer_cache.repeat_interleave(sample_count)
+
+    def feed(m, cache, end, last_only=False):
+        """Appends the committed or proposed positions up to end to the cache of m (they are never padding)."""
+        window = slice(start + cache['dep_layer'].offset, end)
+        return m.decode_s1(token_buffer[0][:, window], token_buffer[1][:, window], stamp_buffer[:, window], kv_cache=cache, last_only=last_only)
+
+    def truncate(cache, length):
+        for layer_cache in cache['transformer'] + [cache['dep_layer']]:
+            layer_cache.truncate(min(len(layer_cache), length))
+
+    progress = tqdm(total=pred_len, disable=not verbose)
+    length = initial_seq_len  # committed positions
+    while length < total_len:
+        # The target pass appends the last committed token and k - 1 proposals
+        k = min(draft_steps, total_len - length, max_context - (length - start) + 1)
+        if k < 1:
+            # Past max_context: one step of model at a time, on the rolling cache or the sliding window
+            if rolling_cache:
+                s1_logits, context = feed(model, kv_cache, length, last_only=True)
+                window_mask, step_cache = None, kv_cache
+            else:
+                window = slice(length - max_context, length)
+                window_mask = mask_buffer[:, window] if mask_buffer is not None else None
+                s1_logits, context = model.decode_s1(token_buffer[0][:, window], token_buffer[1][:, window], stamp_buffer[:, window],
+                                                     padding_mask=window_mask, last_only=True)
+                step_cache = None
+            sample_pre = sample_from_logits(s1_logits[:, -1], temperature=T, top_k=top_k, top_p=top_p)
+            s2_logits = model.decode_s2(context, sample_pre, padding_mask=window_mask, kv_cache=step_cache, last_only=True)
+            sample_post = sample_from_logits(s2_logits[:, -1], temperature=T, top_k=top_k, top_p=top_p)
+            token_buffer[0][:, length:length + 1] = sample_pre
+            token_buffer[1][:, length:length + 1] = sample_post
+            if decoder_cache is not None:
+                z_chunks.append(tokenizer.decode([sample_pre, sample_post], half=True, kv_cache=decoder_cache))
+            length += 1
+            progress.update(1)
+            continue
+
+        # Draft k tokens, keeping the draft distributions q of every sub-token
+        s1_logits, context = feed(draft_model, draft_cache, length, last_only=True)
+        q1, q2 = [], []
+        for j in range(k):
+            q1.append(_sampling_probs(s1_logits[:, -1], T, top_k, top_p))
+            token_buffer[0][:, length + j] = torch.multinomial(q1[-1], 1)[:, 0]
+            s2_logits = draft_model.decode_s2(context, token_buffer[0][:, length + j:length + j + 1], kv_cache=draft_cache, last_only=True)
+            q2.append(_sampling_probs(s2_logits[:, -1], T, top_k, top_p))
+            token_buffer[1][:, length + j] = torch.multinomial(q2[-1], 1)[:, 0]
+            if j + 1 < k:
+                s1_logits, context = feed(draft_model, draft_cache, length + j + 1, last_only=True)
+        q1, q2 = torch.stack(q1, dim=1), torch.stack(q2, dim=1)
+        draft_s1, draft_s2 = token_buffer[0][:, length:length + k], token_buffer[1][:, length:length + k]
+
+        # Score all proposals with one pass of model; the s2 queries attend to the cache up to their own position
+        s1_logits, context = feed(model, kv_cache, length + k - 1)
+        s2_logits = model.decode_s2(context, draft_s1, kv_cache=kv_cache)
+        p1 = torch.stack([_sampling_probs(s1_logits[:, j], T, top_k, top_p) for j in range(k)], dim=1)
+        p2 = torch.stack([_sampling_probs(s2_logits[:, j], T, top_k, top_p) for j in range(k)], dim=1)
+
+        uniforms = torch.rand(2, num_rows, k, device=device)
+        accept_s1 = uniforms[0] * q1.gather(-1, draft_s1.unsqueeze(-1))[..., 0] < p1.gather(-1, draft_s1.unsqueeze(-1))[..., 0]
+        accept_s2 = uniforms[1] * q2.gather(-1, draft_s2.unsqueeze(-1))[..., 0] < p2.gather(-1, draft_s2.unsqueeze(-1))[..., 0]
+        accepted = accept_s1 & accept_s2
+        accepted_len = torch.where(accepted.all(dim=1), k, (~accepted).int().argmax(dim=1))
+        n = int(accepted_len.min())
+        if n < k:
+            # Position n ends the run of every row: a row that rejected it resamples, the others keep their proposal
+            s1_n = torch.where(accept_s1[:, n], draft_s1[:, n], _residual_sample(p1[:, n], q1[:, n])[:, 0])
+            s2_n = torch.where(accept_s2[:, n], draft_s2[:, n], _residual_sample(p2[:, n], q2[:, n])[:, 0])
+            if not bool(accept_s1[:, n].all()):
+                s1_ids = draft_s1.clone()
+                s1_ids[:, n] = s1_n
+                s2_logits = model.decode_s2(context, s1_ids, kv_cache=kv_cache)
+                s2_resampled = torch.multinomial(_sampling_probs(s2_logits[:, n], T, top_k, top_p), 1)[:, 0]
+                s2_n = torch.where(accept_s1[:, n], s2_n, s2_resampled)
+            token_buffer[0][:, length + n] = s1_n
+            token_buffer[1][:, length + n] = s2_n
+        committed = min(n + 1, k)
+        for cache in (kv_cache, draft_cache):
+            truncate(cache, length + n - start)
+        if decoder_cache is not None:
+            z_chunks.append(tokenizer.decode([t[:, length:length + committed] for t in token_buffer], half=True, kv_cache=decoder_cache))
+        length += committed
+        progress.update(committed)
+        progress.set_postfix(accepted=f"{n}/{k}")
+    progress.close()
+
+    if decoder_cache is not None:
+        z = torch.cat(z_chunks, dim=1)[:, -max_context:]
+    else:
+        window = slice(max(total_len - max_context, 0), total_len)
+        window_mask = mask_buffer[:, window] if mask_buffer is not None else None
+        z = tokenizer.decode([token_buffer[0][:, window], token_buffer[1][:, window]], half=True, padding_mask=window_mask)
+        if window_mask is not None:
+            z = z.masked_fill(window_mask.unsqueeze(-1), float('nan'))
+    z = z.reshape(batch_size, sample_count, z.size(1), z.size(2))
+    return np.mean(z.float().cpu().numpy(), axis=1)
+
+
+class QuantileSketch:
+    """
+    Mergeable summary of a stream of observations for quantile estimates, kept independently for every element of
+    a tensor. The observations seen so far are summarized by their quantiles at size evenly spaced probability
+    levels, each standing for an equal share of them. Incoming observations are buffered until size of them have
+    arrived and then merged in one vectorized step: buffer and summary are sorted together, weighted by the number
+    of observations each point stands for, and the combined distribution is read back at the same levels. The
+    summary is exact up to size observations.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.count = 0  # observations in the summary
+        self.values = None  # [..., m] sorted summary points, each standing for count / m observations
+        self.pending = []  # buffered chunks, [..., n] each
+        self.pending_count = 0
+
+    def update(self, samples):
+        """Adds a chunk of observations per element; the last dim indexes the observations."""
+        self.pending.append(samples.float())
+        self.pending_count += samples.size(-1)
+        if self.pending_count >= self.size:
+            self._merge()
+
+    def _merge(self):
+        """Merges the buffered observations into the summary."""
+        samples = torch.cat(self.pending, dim=-1)
+        self.pending, self.pending_count = [], 0
+        if self.values is None:
+            values, weights = samples, torch.ones_like(samples)
+        else:
+            values = torch.cat([self.values, samples], dim=-1)
+            weights = torch.cat([torch.full_like(self.values, self.count / self.values.size(-1)), torch.ones_like(samples)], dim=-1)
+        values, order = values.sort(dim=-1)
+        self.count += samples.size(-1)
+        if values.size(-1) <= self.size:
+            self.values = values
+            return
+
+        # Each sorted point covers the next weight of the cumulative count; point j of the new summary is the
+        # value at the middle of share j, interpolated linearly between the centres of the merged points.
+        weights = weights.gather(-1, order)
+        centres = weights.cumsum(dim=-1) - weights / 2
+        targets = (torch.arange(self.size, device=values.device) + 0.5) * (self.count / self.size)
+        self.values = self._interpolate(values, centres, targets.expand(values.shape[:-1] + (self.size,)).contiguous())
+
+    @staticmethod
+    def _interpolate(values, positions, targets):
+        """Linear interpolation of values at the increasing positions, evaluated at targets and clamped at the ends."""
+        right = torch.searchsorted(positions.contiguous(), targets).clamp(1, positions.size(-1) - 1)
+        x0, x1 = positions.gather(-1, right - 1), positions.gather(-1, right)
+        y0, y1 = values.gather(-1, right - 1), values.gather(-1, right)
+        t = ((targets - x0) / (x1 - x0)).clamp(0, 1)
+        return y0 + t * (y1 - y0)
+
+    def quantile(self, p):
+        """The estimated p-quantile per element; while all observations are still held, as `torch.quantile`."""
+        if self.pending:
+            self._merge()
+        m = self.values.size(-1)
+        if m == 1:
+            return self.values[..., 0]
+        # Exact summaries place observation i at i / (m - 1), compressed ones point j at the middle of share j.
+        exact = self.count <= self.size
+        positions = torch.arange(m, device=self.values.device) + (0.0 if exact else 0.5)
+        targets = torch.full(self.values.shape[:-1] + (1,), p * (m - 1 if exact else m), device=self.values.device)
+        return self._interpolate(self.values, positions.expand_as(self.values).contiguous(), targets).squeeze(-1)
+
+
+class SampleStatistics:
+    """
+    Streaming per-element statistics over Monte Carlo sample paths, fed in chunks of shape [batch, n_samples, ...]:
+    the mean and variance are merged chunk by chunk with Chan et al.'s parallel form of Welford's update, and the
+    requested quantiles are read from one `QuantileSketch`. Everything stays on the device of the samples.
+
+    After a first chunk over the whole batch, later chunks may cover only some of its rows (see `update`), so the
+    number of samples, `count`, is kept per row.
+    """
+
+    def __init__(self, quantiles=()):
+        self.count = None  # [batch] number of samples per row
+        self.mean = None
+        self.m2 = None  # sum of squared deviations from the mean
+        self.quantile_levels = tuple(quantiles)
+        self.sketch = QuantileSketch() if self.quantile_levels else None
+
+    def update(self, samples, index=None):
+        """Adds the samples of one chunk; dim 1 indexes the samples. With index, the chunk holds only those batch rows."""
+        samples = samples.float()
+        n = samples.size(1)
+        mean = samples.mean(dim=1)
+        m2 = ((samples - mean.unsqueeze(1)) ** 2).sum(dim=1)
+        if self.mean is None:
+            if index is not None:
+                raise ValueError("The first chunk must cover the whole batch.")
+            self.count = torch.full((samples.size(0),), n, dtype=torch.float32, device=samples.device)
+            self.mean, self.m2 = mean, m2
+        else:
+            if index is not None and self.sketch is not None:
+                raise ValueError("Quantile sketches need every chunk to cover the whole batch.")
+            index = slice(None) if index is None else index
+            count = self._expand(self.count[index])
+            delta = mean - self.mean[index]
+            self.mean[index] = self.mean[index] + delta * (n / (count + n))
+            self.m2[index] = self.m2[index] + m2 + delta ** 2 * (count * n / (count + n))
+            self.count[index] += n
+        if self.sketch is not None:
+            self.sketch.update(samples.movedim(1, -1))
+
+    def _expand(self, count):
+        return count.view(count.shape + (1,) * (self.mean.dim() - 1))
+
+    @property
+    def std(self):
+        """Population standard deviation over the samples seen so far."""
+        return (self.m2 / self._expand(self.count)).sqrt()
+
+    @property
+    def standard_error(self):
+        """Standard error of the mean, from the sample standard deviation (nan below two samples)."""
+        count = self._expand(self.count)
+        return (self.m2 / (count - 1) / count).sqrt()
+
+    @property
+    def quantiles(self):
+        """The quantile estimates, stacked along a leading dim in the order requested."""
+        return torch.stack([self.sketch.quantile(p) for p in self.quantile_levels])
 
 
 def calc_time_stamps(x_timestamp):
@@ -453,34 +1324,397 @@ def calc_time_stamps(x_timestamp):
     return time_df
 
 
+def time_features(timestamps):
+    """
+    Vectorized `calc_time_stamps` for a flat array of timestamps (e.g. the histories of many series raveled into
+    one array): returns the minute, hour, weekday, day and month features as a float32 array of shape (n, 5).
+    """
+    timestamps = pd.DatetimeIndex(timestamps)
+    return np.stack([timestamps.minute, timestamps.hour, timestamps.weekday, timestamps.day, timestamps.month], axis=-1).astype(np.float32)
+
+
+# KronosPredictor precision names and the corresponding autocast dtypes (None: plain fp32).
+_PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def _half_precision_copy(module, dtype):
+    """
+    Returns a copy of module cast with `half_precision(dtype)`, leaving module itself unchanged like
+    `quantize_dynamic`. Parameters already stored in dtype, e.g. of a half precision checkpoint or the shared
+    weights a `KronosPredictorPool` worker receives, are shared with the copy instead of duplicated; the others
+    are cast straight from the originals, without an intermediate full precision copy.
+    """
+    memo = {id(param): param if param.dtype == dtype else nn.Parameter(param.data, requires_grad=param.requires_grad) for param in module.parameters()}
+    module_copy = copy.deepcopy(module, memo).half_precision(dtype)
+    for param, param_copy in zip(module.parameters(), module_copy.parameters()):
+        if param_copy is not param and param_copy.data_ptr() == param.data_ptr():
+            param_copy.data = param.data.clone()  # kept in full precision, e.g. the tokenizer's quant_embed
+    return module_copy
+
+
+def _autocast_stream(stream, autocast):
+    """Runs every step of the generator `stream` under a fresh `autocast()` context, without leaking it to the caller."""
+    while True:
+        with autocast():
+            item = next(stream, None)
+        if item is None:
+            return
+        yield item
+
+
+def _bucket_length(seq_len, buckets):
+    """Returns the smallest bucket >= seq_len; longer sequences are rounded up to a multiple of the largest bucket."""
+    for bucket in buckets:
+        if seq_len <= bucket:
+            return bucket
+    return -(-seq_len // buckets[-1]) * buckets[-1]
+
+
+def _graph_input(x, seq_len=None, value=0):
+    """
+    Prepares an input of a compiled inference graph: right-pads dim 1 to `seq_len` with `value`, if given,
+    and always returns a new contiguous tensor, so that views into the generation buffers do not add
+    guards on their base, strides or storage offset. The batch dim is marked dynamic and the padded length
+    static, so the graphs are specialized per bucket but shared across batch sizes.
+    """
+    if x is None:
+        return x
+    if seq_len is not None and x.size(1) != seq_len:
+        pad = x.new_full((x.size(0), seq_len - x.size(1)) + tuple(x.shape[2:]), value)
+        x = torch.cat([x, pad], dim=1)
+    else:
+        x = x.clone(memory_format=torch.contiguous_format)
+    torch._dynamo.maybe_mark_dynamic(x, 0)
+    if seq_len is not None:
+        torch._dynamo.mark_static(x, 1)
+    return x
+
+
+def _static_kv_cache(cache):
+    """Converts a prefilled KVCache into a StaticKVCache whose batch dim is shared across compiled graphs."""
+    if isinstance(cache, StaticKVCache):
+        return cache
+    cache = StaticKVCache(cache)
+    torch._dynamo.maybe_mark_dynamic(cache.k, 0)
+    torch._dynamo.maybe_mark_dynamic(cache.v, 0)
+    torch._dynamo.maybe_mark_dynamic(cache.pad, 0)
+    return cache
+
+
+def _build_rotary_tables(module, seq_len):
+    """
+    Builds the shared rotary tables of `module` for at least seq_len positions outside of the compiled graphs,
+    which would otherwise guard on their creation. Returns the table length.
+    """
+    param = next(module.parameters())
+    table_len = seq_len
+    for m in module.modules():
+        if isinstance(m, RotaryPositionalEmbedding):
+            table_len = m._get_cos_sin_table(param, seq_len)[0].size(-2)
+    return table_len
+
+
+class CompiledKronosTokenizer:
+    """
+    torch.compile'd inference wrapper around a KronosTokenizer, with the same `encode`, `decode` and
+    `new_kv_cache` interface.
+
+    Full-sequence calls are right-padded to the next context-length bucket, so they run through one graph
+    per bucket. The encoder and decoder are causal, so the padding does not change the outputs of the real
+    positions. For single-step `decode` calls, the prefilled KV cache is converted into StaticKVCaches in
+    place, so every step runs through the same graph. KV caches are allocated for max_context positions,
+    which keeps their shapes independent of the forecast length.
+
+    Args:
+        tokenizer (KronosTokenizer): The tokenizer to compile, in eval mode.
+        max_context (int): Maximum context length; the largest bucket.
+        context_buckets (Sequence[int]): Padded sequence lengths for full-sequence calls, ending with max_context.
+    """
+
+    def __init__(self, tokenizer, max_context, context_buckets):
+        self.module = tokenizer
+        self.max_context = max_context
+        self.context_buckets = context_buckets
+        self.rotary_len = _build_rotary_tables(tokenizer, max_context)
+        self._encode_padded = torch.compile(self._encode)
+        self._decode_padded = torch.compile(self._decode)
+        self._decode_step = torch.compile(self._decode_incremental)
+
+    def _encode(self, x, half, padding_mask):
+        return self.module.encode(x, half, padding_mask)
+
+    def _decode(self, x, half, kv_cache, padding_mask):
+        return self.module.decode(x, half, kv_cache=kv_cache, padding_mask=padding_mask)
+
+    def _decode_incremental(self, x, half, kv_cache):
+        return self.module.decode(x, half, kv_cache=kv_cache)
+
+    def new_kv_cache(self, max_len=None, capacity=None):
+        return self.module.new_kv_cache(max_len, self.max_context)
+
+    def encode(self, x, half=False, padding_mask=None):
+        seq_len = x.size(1)
+        length = _bucket_length(seq_len, self.context_buckets)
+        indices = self._encode_padded(_graph_input(x, length), half, _graph_input(padding_mask, length, 1))
+        if half:
+            return [t[:, :seq_len] for t in indices]
+        return indices[:, :seq_len]
+
+    def decode(self, x, half=False, kv_cache=None, padding_mask=None):
+        if kv_cache is not None and len(kv_cache[0]) > 0:
+            # Generated positions are never padding, so padding_mask is not needed here
+            kv_cache[:] = [_static_kv_cache(cache) for cache in kv_cache]
+            if len(kv_cache[0]) >= self.rotary_len:
+                self.rotary_len = _build_rotary_tables(self.module, len(kv_cache[0]) + 1)
+            z = self._decode_step([_graph_input(t) for t in x] if half else _graph_input(x), half, kv_cache)
+            for cache in kv_cache:
+                cache.length += 1
+            return z
+
+        seq_len = x[0].size(1) if half else x.size(1)
+        length = _bucket_length(seq_len, self.context_buckets)
+        x = [_graph_input(t, length) for t in x] if half else _graph_input(x, length)
+        z = self._decode_padded(x, half, kv_cache, _graph_input(padding_mask, length, 1))
+        if kv_cache is not None:
+            for cache in kv_cache:
+                cache.truncate(seq_len)
+        return z[:, :seq_len]
+
+
+class CompiledKronos:
+    """
+    torch.compile'd inference wrapper around a Kronos model, with the same `decode_s1`, `decode_s2` and
+    `new_kv_cache` interface. As in `CompiledKronosTokenizer`, prefill and full-window `decode_s1` calls are
+    right-padded to a context-length bucket, and single-step calls on a filled KV cache run on StaticKVCaches.
+    `decode_s2` without a cache attends to the whole, non-causal context, so it is compiled for the exact
+    context length instead (max_context in `auto_regressive_stream`).
+
+    Args:
+        model (Kronos): The model to compile, in eval mode.
+        max_context (int): Maximum context length; the largest bucket.
+        context_buckets (Sequence[int]): Padded sequence lengths for full-sequence calls, ending with max_context.
+    """
+
+    def __init__(self, model, max_context, context_buckets):
+        self.module = model
+        self.max_context = max_context
+        self.context_buckets = context_buckets
+        self.rotary_len = _build_rotary_tables(model, max_context)
+        self._decode_s1_padded = torch.compile(self._decode_s1_last)
+        self._decode_s1_step = torch.compile(self._decode_s1)
+        self._decode_s2_full = torch.compile(self._decode_s2)
+        self._decode_s2_step = torch.compile(self._decode_s2_incremental)
+
+    def _decode_s1_last(self, s1_ids, s2_ids, stamp, padding_mask, kv_cache, last_index):
+        _, context = self.module.decode_s1(s1_ids, s2_ids, stamp, padding_mask, kv_cache=kv_cache, last_only=True)
+        return self.module.head(context.index_select(1, last_index)), context
+
+    def _decode_s1(self, s1_ids, s2_ids, stamp, padding_mask, kv_cache, last_only):
+        return self.module.decode_s1(s1_ids, s2_ids, stamp, padding_mask, kv_cache=kv_cache, last_only=last_only)
+
+    def _decode_s2(self, context, s1_ids, padding_mask, last_only):
+        return self.module.decode_s2(context, s1_ids, padding_mask, last_only=last_only)
+
+    def _decode_s2_incremental(self, context, s1_ids, padding_mask, kv_cache, last_only):
+        return self.module.decode_s2(context, s1_ids, padding_mask, kv_cache=kv_cache, last_only=last_only)
+
+    def _static_kv_cache(self, kv_cache):
+        kv_cache['transformer'] = [_static_kv_cache(cache) for cache in kv_cache['transformer']]
+        kv_cache['dep_layer'] = _static_kv_cache(kv_cache['dep_layer'])
+        return kv_cache['transformer'] + [kv_cache['dep_layer']]
+
+    def new_kv_cache(self, max_len=None, capacity=None):
+        return self.module.new_kv_cache(max_len, self.max_context)
+
+    def decode_s1(self, s1_ids, s2_ids, stamp=None, padding_mask=None, kv_cache=None, last_only=False):
+        if kv_cache is not None and len(kv_cache['dep_layer']) > 0:
+            caches = self._static_kv_cache(kv_cache)
+            if len(caches[0]) >= self.rotary_len:
+                self.rotary_len = _build_rotary_tables(self.module, len(caches[0]) + 1)
+            outputs = self._decode_s1_step(_graph_input(s1_ids), _graph_input(s2_ids), _graph_input(stamp), _graph_input(padding_mask),
+                                           kv_cache, last_only)
+            for cache in caches:
+                cache.length += 1
+            return outputs
+
+        seq_len = s1_ids.size(1)
+        length = _bucket_length(seq_len, self.context_buckets)
+        last_index = torch.full((1,), seq_len - 1, dtype=torch.long, device=s1_ids.device)
+        s1_logits, context = self._decode_s1_padded(_graph_input(s1_ids, length), _graph_input(s2_ids, length), _graph_input(stamp, length),
+                                                    _graph_input(padding_mask, length, 1), kv_cache, last_index)
+        if kv_cache is not None:
+            for cache in kv_cache['transformer'] + [kv_cache['dep_layer']]:
+                cache.truncate(seq_len)
+        context = context[:, :seq_len]
+        if not last_only:
+            s1_logits = self.module.head(context)
+        return s1_logits, context
+
+    def decode_s2(self, context, s1_ids, padding_mask=None, kv_cache=None, last_only=False):
+        if kv_cache is not None:
+            self._static_kv_cache(kv_cache)
+            return self._decode_s2_step(_graph_input(context), _graph_input(s1_ids), _graph_input(padding_mask), kv_cache, last_only)
+        return self._decode_s2_full(_graph_input(context, context.size(1)), _graph_input(s1_ids, s1_ids.size(1)),
+                                    _graph_input(padding_mask, context.size(1)), last_only)
+
+
 class KronosPredictor:
 
-    def __init__(self, model, tokenizer, device="cuda:0", max_context=512, clip=5):
+    def __init__(self, model, tokenizer, device="cuda:0", max_context=512, clip=5, rolling_cache=False, compile=False,
+                 context_buckets=(64, 128, 256, 512), quantize=False, precision="fp32", sample_chunk=None, draft_model=None, draft_tokenizer=None,
+                 draft_steps=4):
+        """
+        Args:
+            model (Kronos): The Kronos model.
+            tokenizer (KronosTokenizer): The tokenizer the model was trained with.
+            device (str): Device to run inference on.
+            max_context (int): Maximum number of tokens the model attends to.
+            clip (float): Clipping value of the normalized inputs.
+            rolling_cache (bool): Keep a rolling KV cache past max_context instead of re-encoding the
+                                  window every step. See `auto_regressive_inference`.
+            compile (bool): Run inference through torch.compile'd graphs (`CompiledKronos`,
+                            `CompiledKronosTokenizer`). The graphs are compiled and warmed up here, one
+                            set per context bucket, so construction takes a while.
+            context_buckets (Sequence[int]): Padded context lengths used with compile. Buckets above
+                                             max_context are dropped and max_context is always added.
+            quantize (bool): Run on int8 dynamically quantized copies of the model and tokenizer
+                             (`Kronos.quantize_dynamic`, `KronosTokenizer.quantize_dynamic`). CPU only.
+            precision (str): "fp32", or "bf16"/"fp16" to run on copies of the model and tokenizer with the
+                             weights in that dtype (see `Kronos.half_precision`) under torch.autocast. RMSNorm
+                             statistics, the BSQ sign projection and sampling stay in fp32.
+            sample_chunk (int, optional): Decode at most this many samples per series at once and aggregate
+                                          the paths on the device, bounding the memory of large sample_count.
+                                          Defaults to None (all samples at once).
+            draft_model (Kronos, optional): A smaller model that drafts tokens for speculative sampling
+                                            (`auto_regressive_speculative`) in `predict`, `predict_batch`,
+                                            `predict_arrays` and `predict_panel`. The forecasts keep the
+                                            distribution of the model; mainly the latency of long pred_len with
+                                            few series and samples improves. Runs on the eager modules, also
+                                            with compile, and is quantized and cast like the model.
+            draft_tokenizer (KronosTokenizer, optional): The tokenizer the draft model was trained with, required
+                                                         with draft_model and checked to be identical to tokenizer
+                                                         (the same object is accepted as is).
+            draft_steps (int): Number of tokens drafted per forward pass of the model.
+        """
+        if precision not in _PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {list(_PRECISIONS)}.")
+        if quantize and precision != "fp32":
+            raise ValueError("Int8 dynamic quantization requires precision='fp32'.")
+        if draft_model is not None:
+            _check_draft_model(tokenizer, model, draft_tokenizer, draft_model)
         self.tokenizer = tokenizer
         self.model = model
+        self.draft_model = draft_model
+        self.draft_steps = draft_steps
         self.max_context = max_context
         self.clip = clip
+        self.rolling_cache = rolling_cache
+        self.sample_chunk = sample_chunk
         self.price_cols = ['open', 'high', 'low', 'close']
         self.vol_col = 'volume'
         self.amt_vol = 'amount'
         self.time_cols = ['minute', 'hour', 'weekday', 'day', 'month']
         self.device = device
+        self.dtype = _PRECISIONS[precision]
 
         self.tokenizer = self.tokenizer.to(self.device)
         self.model = self.model.to(self.device)
+        if quantize:
+            if torch.device(self.device).type != 'cpu':
+                raise ValueError("Int8 dynamic quantization is only supported on CPU.")
+            self.tokenizer = self.tokenizer.quantize_dynamic()
+            self.model = self.model.quantize_dynamic()
+        if self.dtype is not None:
+            self.tokenizer = _half_precision_copy(self.tokenizer, self.dtype)
+            self.model = _half_precision_copy(self.model, self.dtype)
+        if self.draft_model is not None:
+            self.draft_model = self.draft_model.to(self.device)
+            if quantize:
+                self.draft_model = self.draft_model.quantize_dynamic()
+            if self.dtype is not None:
+                self.draft_model = _half_precision_copy(self.draft_model, self.dtype)
+
+        # Modules the generation loop runs on: the models themselves, or their compiled wrappers.
+        self.inference_tokenizer, self.inference_model = self.tokenizer, self.model
+        if compile:
+            self.context_buckets = sorted(b for b in set(context_buckets) if b < max_context) + [max_context]
+            self.inference_tokenizer = CompiledKronosTokenizer(self.tokenizer, max_context, self.context_buckets)
+            self.inference_model = CompiledKronos(self.model, max_context, self.context_buckets)
+            self._warmup()
+
+    def _autocast(self):
+        """Autocast context of the configured precision (disabled for fp32)."""
+        return torch.autocast(torch.device(self.device).type, dtype=self.dtype, enabled=self.dtype is not None)
+
+    def _warmup(self):
+        """
+        Compiles the inference graphs by forecasting a few steps from a dummy context of every bucket length.
+        torch.compile specializes size-1 dims, so both a single series with one sample and a batch of
+        several samples are run.
+        """
+        for bucket in self.context_buckets:
+            for batch_size, sample_count in ((1, 1), (2, 2)):
+                x = torch.zeros(batch_size, bucket, self.tokenizer.d_in, device=self.device)
+                x_stamp = torch.zeros(batch_size, bucket, len(self.time_cols), device=self.device)
+                y_stamp = torch.zeros(batch_size, 3, len(self.time_cols), device=self.device)
+                with self._autocast():
+                    auto_regressive_inference(self.inference_tokenizer, self.inference_model, x, x_stamp, y_stamp, self.max_context, 3,
+                                              self.clip, sample_count=sample_count, rolling_cache=self.rolling_cache)
 
-    def generate(self, x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose):
+    def generate(self, x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, padding_mask=None, seed=None):
 
         x_tensor = torch.from_numpy(np.array(x).astype(np.float32)).to(self.device)
         x_stamp_tensor = torch.from_numpy(np.array(x_stamp).astype(np.float32)).to(self.device)
         y_stamp_tensor = torch.from_numpy(np.array(y_stamp).astype(np.float32)).to(self.device)
-
-        preds = auto_regressive_inference(self.tokenizer, self.model, x_tensor, x_stamp_tensor, y_stamp_tensor, self.max_context, pred_len,
-                                          self.clip, T, top_k, top_p, sample_count, verbose)
-        preds = preds[:, -pred_len:, :]
+        if padding_mask is not None:
+            padding_mask = torch.from_numpy(np.asarray(padding_mask, dtype=bool)).to(self.device)
+
+        if self.draft_model is not None:
+            if seed is not None:
+                raise ValueError("Seeded sampling is not supported with a draft model.")
+            # Series with shorter horizons are sampled along to the longest one and cut afterwards. The draft
+            # tokenizer was checked against the tokenizer in __init__, before quantization or casting.
+            with self._autocast():
+                preds = auto_regressive_speculative(self.tokenizer, self.model, self.tokenizer, self.draft_model, x_tensor, x_stamp_tensor, y_stamp_tensor,
+                                                    self.max_context, int(np.max(pred_len)), self.clip, T, top_k, top_p, sample_count, verbose,
+                                                    rolling_cache=self.rolling_cache, padding_mask=padding_mask, draft_steps=self.draft_steps)
+            return preds[:, -int(np.max(pred_len)):, :]
+
+        with self._autocast():
+            preds = auto_regressive_inference(self.inference_tokenizer, self.inference_model, x_tensor, x_stamp_tensor, y_stamp_tensor, self.max_context, pred_len,
+                                              self.clip, T, top_k, top_p, sample_count, verbose, rolling_cache=self.rolling_cache,
+                                              padding_mask=padding_mask, sample_chunk=self.sample_chunk, seed=seed)
+        preds = preds[:, -int(np.max(pred_len)):, :]
         return preds
 
-    def predict(self, df, x_timestamp, y_timestamp, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True):
+    def generate_adaptive(self, x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, tolerance, padding_mask=None, seed=None):
+        """Adaptive `generate` (see `auto_regressive_adaptive`): returns the forecasts and the number of paths drawn per series."""
+
+        x_tensor, x_stamp_tensor, y_stamp_tensor = (torch.from_numpy(np.array(a).astype(np.float32)).to(self.device) for a in (x, x_stamp, y_stamp))
+        if padding_mask is not None:
+            padding_mask = torch.from_numpy(np.asarray(padding_mask, dtype=bool)).to(self.device)
+
+        with self._autocast():
+            return auto_regressive_adaptive(self.inference_tokenizer, self.inference_model, x_tensor, x_stamp_tensor, y_stamp_tensor, self.max_context, pred_len,
+                                            self.clip, T, top_k, top_p, sample_count, verbose, rolling_cache=self.rolling_cache,
+                                            padding_mask=padding_mask, tolerance=tolerance, seed=seed)
+
+    def generate_stream(self, x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, seed=None):
+        """Yields the normalized forecast of every sample for each step, as an array of shape (batch, sample_count, feat)."""
+
+        x_tensor = torch.from_numpy(np.array(x).astype(np.float32)).to(self.device)
+        x_stamp_tensor = torch.from_numpy(np.array(x_stamp).astype(np.float32)).to(self.device)
+        y_stamp_tensor = torch.from_numpy(np.array(y_stamp).astype(np.float32)).to(self.device)
+
+        stream = auto_regressive_stream(self.inference_tokenizer, self.inference_model, x_tensor, x_stamp_tensor, y_stamp_tensor, self.max_context, pred_len,
+                                        self.clip, T, top_k, top_p, sample_count, verbose, rolling_cache=self.rolling_cache, seed=seed)
+        stream = _autocast_stream(stream, self._autocast)
+        next(stream)  # decoded context
+        for _, z in stream:
+            yield z.reshape(-1, sample_count, z.size(-1)).float().cpu().numpy()
+
+    def _prepare_input(self, df, x_timestamp, y_timestamp):
+        """Validates a single series and returns its normalized inputs together with the normalization statistics."""
 
         if not isinstance(df, pd.DataFrame):
             raise ValueError("Input must be a pandas DataFrame.")
@@ -513,34 +1747,110 @@ class KronosPredictor:
         x = x[np.newaxis, :]
         x_stamp = x_stamp[np.newaxis, :]
         y_stamp = y_stamp[np.newaxis, :]
+        return x, x_stamp, y_stamp, x_mean, x_std
+
+    def predict(self, df, x_timestamp, y_timestamp, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True, tolerance=None, seed=None):
 
-        preds = self.generate(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose)
+        x, x_stamp, y_stamp, x_mean, x_std = self._prepare_input(df, x_timestamp, y_timestamp)
+
+        if tolerance is None:
+            preds = self.generate(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, seed=seed)
+        else:
+            preds, sample_counts = self.generate_adaptive(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, tolerance, seed=seed)
 
         preds = preds.squeeze(0)
         preds = preds * (x_std + 1e-5) + x_mean
 
         pred_df = pd.DataFrame(preds, columns=self.price_cols + [self.vol_col, self.amt_vol], index=y_timestamp)
+        if tolerance is not None:
+            pred_df.attrs['sample_count'] = int(sample_counts[0])
         return pred_df
 
+    def predict_distribution(self, df, x_timestamp, y_timestamp, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1000, quantiles=(0.05, 0.5, 0.95),
+                             verbose=True, seed=None):
+        """
+        Monte Carlo forecast bands: samples sample_count paths in chunks of `sample_chunk` (64 if not set) and
+        aggregates them on the device with streaming statistics (`auto_regressive_statistics`), so memory does
+        not grow with sample_count.
+
+        Args:
+            Same as `predict`, plus
+            quantiles (Sequence[float]): Quantile levels of the bands (see `QuantileSketch`).
+
+        Returns:
+            pd.DataFrame: Indexed by `y_timestamp`, with the sample mean of `open, high, low, close, volume, amount`,
+                          their standard deviation in `<col>_std` columns and one `<col>_p<level>` column per
+                          quantile, e.g. `close_p5`, `close_p50` and `close_p95`.
+        """
+        x, x_stamp, y_stamp, x_mean, x_std = self._prepare_input(df, x_timestamp, y_timestamp)
+        x, x_stamp, y_stamp = (torch.from_numpy(a.astype(np.float32)).to(self.device) for a in (x, x_stamp, y_stamp))
+
+        with self._autocast():
+            mean, std, bands = auto_regressive_statistics(self.inference_tokenizer, self.inference_model, x, x_stamp, y_stamp, self.max_context, pred_len,
+                                                          self.clip, T, top_k, top_p, sample_count, verbose, rolling_cache=self.rolling_cache,
+                                                          sample_chunk=self.sample_chunk or 64, quantiles=quantiles, seed=seed)
+
+        cols = self.price_cols + [self.vol_col, self.amt_vol]
+        values = [mean[0] * (x_std + 1e-5) + x_mean, std[0] * (x_std + 1e-5)] + [band[0] * (x_std + 1e-5) + x_mean for band in bands]
+        columns = cols + [f"{col}_std" for col in cols] + [f"{col}_p{q * 100:g}" for q in quantiles for col in cols]
+        return pd.DataFrame(np.concatenate(values, axis=-1), columns=columns, index=y_timestamp)
+
+    def predict_stream(self, df, x_timestamp, y_timestamp, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=False, seed=None):
+        """
+        Generator version of `predict` that yields every forecast bar as soon as it has been sampled.
+
+        Args:
+            Same as `predict`.
+
+        Yields:
+            pd.DataFrame: One row indexed by the bar's timestamp from `y_timestamp`, with the sample mean of
+                          `open, high, low, close, volume, amount` (the values `predict` returns) and their
+                          standard deviation across the sample_count paths in `<col>_std` columns.
 
-    def predict_batch(self, df_list, x_timestamp_list, y_timestamp_list, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True):
+        Note:
+            Without `rolling_cache`, bars past max_context are decoded with a rolling tokenizer window and can
+            differ slightly from `predict`, which re-decodes the final window from scratch.
         """
-        Perform parallel (batch) prediction on multiple time series. All series must have the same historical length and prediction length (pred_len).
+        x, x_stamp, y_stamp, x_mean, x_std = self._prepare_input(df, x_timestamp, y_timestamp)
+
+        cols = self.price_cols + [self.vol_col, self.amt_vol]
+        y_index = pd.Index(y_timestamp)
+        for i, samples in enumerate(self.generate_stream(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, seed=seed)):
+            samples = samples[0] * (x_std + 1e-5) + x_mean  # (sample_count, feat)
+            row = np.concatenate([samples.mean(axis=0), samples.std(axis=0)])
+            yield pd.DataFrame(row[np.newaxis, :], columns=cols + [f"{col}_std" for col in cols], index=y_index[i:i + 1])
+
+    def predict_batch(self, df_list, x_timestamp_list, y_timestamp_list, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True,
+                      tolerance=None, seed=None):
+        """
+        Perform parallel (batch) prediction on multiple time series.
+
+        Series may differ in historical length and prediction length: shorter histories are left-padded and
+        masked out of attention, and a series is retired from the batch once its own horizon is reached.
 
         Args:
             df_list (List[pd.DataFrame]): List of input DataFrames, each containing price columns and optional volume/amount columns.
             x_timestamp_list (List[pd.DatetimeIndex or Series]): List of timestamps corresponding to historical data, length should match the number of rows in each DataFrame.
-            y_timestamp_list (List[pd.DatetimeIndex or Series]): List of future prediction timestamps, length should equal pred_len.
-            pred_len (int): Number of prediction steps.
-            T (float): Sampling temperature.
-            top_k (int): Top-k filtering threshold.
-            top_p (float): Top-p (nucleus sampling) threshold.
+            y_timestamp_list (List[pd.DatetimeIndex or Series]): List of future prediction timestamps, length should equal the series' pred_len.
+            pred_len (int or Sequence[int]): Number of prediction steps, either shared or one per series.
+            T (float or Sequence[float]): Sampling temperature, either shared or one per series.
+            top_k (int or Sequence[int]): Top-k filtering threshold, either shared or one per series.
+            top_p (float or Sequence[float]): Top-p (nucleus sampling) threshold, either shared or one per series.
             sample_count (int): Number of parallel samples per series, automatically averaged internally.
             verbose (bool): Whether to display autoregressive progress.
+            tolerance (float, optional): Adaptive sampling (see `auto_regressive_adaptive`): the samples are drawn in
+                                         rounds until the standard error of a series' mean close forecast, relative
+                                         to its standard deviation, is at most tolerance at every step. sample_count
+                                         is then the maximum. Defaults to None (always sample_count samples).
+            seed (int or Sequence[int], optional): Seed of the sampling, either shared or one per series. A series'
+                                                   paths then depend only on its input and seed, not on the other
+                                                   series in the batch: the same series and seed give the same forecast
+                                                   through `predict` or `predict_batch`. Defaults to None (torch's global RNG).
 
         Returns:
             List[pd.DataFrame]: List of prediction results in the same order as input, each DataFrame contains
                                 `open, high, low, close, volume, amount` columns, indexed by corresponding `y_timestamp`.
+                                With tolerance, `attrs['sample_count']` holds the number of samples drawn.
         """
         # Basic validation
         if not isinstance(df_list, (list, tuple)) or not isinstance(x_timestamp_list, (list, tuple)) or not isinstance(y_timestamp_list, (list, tuple)):
@@ -549,6 +1859,9 @@ class KronosPredictor:
             raise ValueError("df_list, x_timestamp_list, y_timestamp_list must have consistent lengths.")
 
         num_series = len(df_list)
+        if np.ndim(pred_len) > 0 and len(pred_len) != num_series:
+            raise ValueError(f"pred_len must be an int or hold one value per series ({num_series}), got {len(pred_len)} values.")
+        horizons = [int(p) for p in np.broadcast_to(pred_len, (num_series,))]
 
         x_list = []
         x_stamp_list = []
@@ -587,8 +1900,8 @@ class KronosPredictor:
 
             if x.shape[0] != x_stamp.shape[0]:
                 raise ValueError(f"Inconsistent lengths at index {i}: x has {x.shape[0]} vs x_stamp has {x_stamp.shape[0]}.")
-            if y_stamp.shape[0] != pred_len:
-                raise ValueError(f"y_timestamp length at index {i} should equal pred_len={pred_len}, got {y_stamp.shape[0]}.")
+            if y_stamp.shape[0] != horizons[i]:
+                raise ValueError(f"y_timestamp length at index {i} should equal pred_len={horizons[i]}, got {y_stamp.shape[0]}.")
 
             x_mean, x_std = np.mean(x, axis=0), np.std(x, axis=0)
             x_norm = (x - x_mean) / (x_std + 1e-5)
@@ -603,24 +1916,539 @@ class KronosPredictor:
             seq_lens.append(x_norm.shape[0])
             y_lens.append(y_stamp.shape[0])
 
-        # Require all series to have consistent historical and prediction lengths for batch processing
+        # Ragged histories are left-padded to the longest one and masked out, ragged horizons share the time axis of the longest
+        seq_len, max_pred_len = max(seq_lens), max(y_lens)
+        padding_mask = None
         if len(set(seq_lens)) != 1:
-            raise ValueError(f"Parallel prediction requires all series to have consistent historical lengths, got: {seq_lens}")
-        if len(set(y_lens)) != 1:
-            raise ValueError(f"Parallel prediction requires all series to have consistent prediction lengths, got: {y_lens}")
+            padding_mask = np.arange(seq_len)[np.newaxis, :] < (seq_len - np.array(seq_lens))[:, np.newaxis]
+        pred_len = max_pred_len if len(set(y_lens)) == 1 else y_lens
 
-        x_batch = np.stack(x_list, axis=0).astype(np.float32)           # (B, seq_len, feat)
-        x_stamp_batch = np.stack(x_stamp_list, axis=0).astype(np.float32) # (B, seq_len, time_feat)
-        y_stamp_batch = np.stack(y_stamp_list, axis=0).astype(np.float32) # (B, pred_len, time_feat)
+        x_batch = np.stack([np.pad(x, ((seq_len - len(x), 0), (0, 0))) for x in x_list], axis=0).astype(np.float32)  # (B, seq_len, feat)
+        x_stamp_batch = np.stack([np.pad(s, ((seq_len - len(s), 0), (0, 0))) for s in x_stamp_list], axis=0).astype(np.float32)  # (B, seq_len, time_feat)
+        y_stamp_batch = np.stack([np.pad(s, ((0, max_pred_len - len(s)), (0, 0))) for s in y_stamp_list], axis=0).astype(np.float32)  # (B, pred_len, time_feat)
 
-        preds = self.generate(x_batch, x_stamp_batch, y_stamp_batch, pred_len, T, top_k, top_p, sample_count, verbose)
-        # preds: (B, pred_len, feat)
+        if tolerance is None:
+            preds = self.generate(x_batch, x_stamp_batch, y_stamp_batch, pred_len, T, top_k, top_p, sample_count, verbose, padding_mask=padding_mask,
+                                  seed=seed)
+        else:
+            preds, sample_counts = self.generate_adaptive(x_batch, x_stamp_batch, y_stamp_batch, pred_len, T, top_k, top_p, sample_count, verbose,
+                                                          tolerance, padding_mask=padding_mask, seed=seed)
+        # preds: (B, max pred_len, feat)
 
         pred_dfs = []
         for i in range(num_series):
-            preds_i = preds[i] * (stds[i] + 1e-5) + means[i]
+            preds_i = preds[i, :y_lens[i]] * (stds[i] + 1e-5) + means[i]
             pred_df = pd.DataFrame(preds_i, columns=self.price_cols + [self.vol_col, self.amt_vol], index=y_timestamp_list[i])
+            if tolerance is not None:
+                pred_df.attrs['sample_count'] = int(sample_counts[i])
             pred_dfs.append(pred_df)
 
         return pred_dfs
 
+    def _normalize_arrays(self, x, valid=None):
+        """
+        Vectorized counterpart of the per-series preparation in `predict_batch`: completes the volume/amount
+        columns of x ([batch, seq_len, 4..6]) and normalizes every series over its valid positions. Padded
+        positions (valid False) are zeroed. Returns the normalized inputs and the per-series mean and std.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim != 3 or x.shape[-1] not in (4, 5, 6):
+            raise ValueError(f"Expected inputs of shape (batch, seq_len, 4..6) with columns {self.price_cols + [self.vol_col, self.amt_vol]}, "
+                             f"got {x.shape}.")
+        if x.shape[-1] == 4:
+            x = np.concatenate([x, np.zeros_like(x[..., :2])], axis=-1)  # missing volume and amount are zero
+        elif x.shape[-1] == 5:
+            x = np.concatenate([x, x[..., 4:5] * x[..., :4].mean(axis=-1, keepdims=True)], axis=-1)
+
+        weights = np.ones(x.shape[:2] + (1,), dtype=np.float32) if valid is None else valid[..., np.newaxis].astype(np.float32)
+        x = np.where(weights > 0, x, 0)
+        if np.isnan(x).any():
+            raise ValueError("Input contains NaN values in price or volume columns.")
+        count = weights.sum(axis=1)
+        x_mean = np.sum(x, axis=1, dtype=np.float64) / count
+        x_std = np.sqrt(np.sum(((x - x_mean[:, np.newaxis]) * weights) ** 2, axis=1, dtype=np.float64) / count)
+        x_mean, x_std = x_mean.astype(np.float32), x_std.astype(np.float32)
+
+        x = (x - x_mean[:, np.newaxis]) / (x_std[:, np.newaxis] + 1e-5)
+        x = np.clip(x, -self.clip, self.clip) * weights
+        return x.astype(np.float32), x_mean, x_std
+
+    def predict_arrays(self, x, x_timestamp, y_timestamp, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True, seed=None):
+        """
+        Array-native batch prediction: normalization and time features are computed for all series at once.
+        As in `predict_batch`, every series is normalized over its full history, which is encoded as a whole
+        before the model attends to its last max_context tokens, so both give the same forecasts.
+
+        Args:
+            x (np.ndarray): History of shape (batch, seq_len, n_cols), with the columns
+                            `open, high, low, close[, volume[, amount]]`; missing ones are filled as in `predict`.
+            x_timestamp (array-like): Timestamps of the history, of shape (batch, seq_len) or (seq_len,) if shared.
+            y_timestamp (array-like): Timestamps to forecast, of shape (batch, pred_len) or (pred_len,) if shared.
+            T, top_k, top_p, sample_count, verbose, seed: See `predict_batch`.
+
+        Returns:
+            np.ndarray: Forecasts of shape (batch, pred_len, 6), columns `open, high, low, close, volume, amount`.
+        """
+        x = np.asarray(x, dtype=np.float32)
+        batch_size, seq_len = x.shape[:2]
+        x_timestamp = np.asarray(x_timestamp)
+        y_timestamp = np.asarray(y_timestamp)
+        if x_timestamp.shape[-1] != seq_len or x_timestamp.ndim not in (1, 2) or y_timestamp.ndim not in (1, 2):
+            raise ValueError(f"x_timestamp must have shape ({batch_size}, {seq_len}) or ({seq_len},), got {x_timestamp.shape}; "
+                             f"y_timestamp must be 1- or 2-dimensional, got {y_timestamp.shape}.")
+        pred_len = y_timestamp.shape[-1]
+        if pred_len < 1:
+            raise ValueError("y_timestamp must hold at least one timestamp to forecast.")
+
+        x, x_mean, x_std = self._normalize_arrays(x)
+        x_stamp = np.broadcast_to(time_features(x_timestamp.ravel()).reshape(x_timestamp.shape + (-1,)), (batch_size, seq_len, len(self.time_cols)))
+        y_stamp = np.broadcast_to(time_features(y_timestamp.ravel()).reshape(y_timestamp.shape + (-1,)), (batch_size, pred_len, len(self.time_cols)))
+
+        preds = self.generate(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, seed=seed)
+        return preds * (x_std[:, np.newaxis] + 1e-5) + x_mean[:, np.newaxis]
+
+    def predict_panel(self, df, y_timestamp, T=1.0, top_k=0, top_p=0.9, sample_count=1, verbose=True, symbol_col='symbol', timestamp_col='timestamps',
+                      seed=None):
+        """
+        Forecasts every symbol of a long-format panel in one batch. The rows of each symbol are gathered with
+        array indexing instead of a DataFrame per series and prepared as in `predict_arrays`, so the forecasts
+        equal those of `predict_batch`. Shorter histories are left-padded and masked.
+
+        Args:
+            df (pd.DataFrame): History with one row per symbol and timestamp: symbol_col, timestamp_col, the
+                               price columns and optionally volume/amount. Rows do not need to be sorted.
+            y_timestamp (pd.DataFrame or array-like): Timestamps to forecast, either as a DataFrame with
+                                                      symbol_col and timestamp_col rows for every symbol (the
+                                                      horizons may differ), or one sequence shared by all symbols.
+            T, top_k, top_p, sample_count, verbose, seed: See `predict_batch`; per-series values follow the order of
+                                                          first appearance of the symbols in df.
+            symbol_col (str): Name of the symbol column.
+            timestamp_col (str): Name of the timestamp column.
+
+        Returns:
+            pd.DataFrame: Long-format forecasts with symbol_col, timestamp_col and `open, high, low, close, volume, amount`
+                          columns, symbols in order of first appearance in df.
+        """
+        if not all(col in df.columns for col in [symbol_col, timestamp_col] + self.price_cols):
+            raise ValueError(f"Panel must contain the columns {[symbol_col, timestamp_col] + self.price_cols}.")
+        codes, symbols = pd.factorize(df[symbol_col])
+        times = pd.DatetimeIndex(df[timestamp_col])
+
+        # Gather of the rows of every symbol from the (symbol, timestamp) order, right-aligned so that shorter
+        # histories are left-padded
+        order = np.lexsort((times.asi8, codes))
+        counts = np.bincount(codes, minlength=len(symbols))
+        ends = np.cumsum(counts)
+        seq_len = int(counts.max())
+        index = ends[:, np.newaxis] - seq_len + np.arange(seq_len)
+        valid = index >= (ends - counts)[:, np.newaxis]
+        rows = order[np.where(valid, index, ends[:, np.newaxis] - 1)]
+
+        cols = self.price_cols + [col for col in (self.vol_col, self.amt_vol) if col in df.columns]
+        if self.amt_vol in cols and self.vol_col not in cols:
+            cols = self.price_cols  # amount without volume is ignored, as in `predict`
+        x, x_mean, x_std = self._normalize_arrays(df[cols].to_numpy(dtype=np.float32)[rows], valid)
+        x_stamp = time_features(times[rows.ravel()]).reshape(rows.shape + (-1,)) * valid[..., np.newaxis]
+        padding_mask = None if valid.all() else ~valid
+
+        if isinstance(y_timestamp, pd.DataFrame):
+            y_codes = pd.Index(symbols).get_indexer(y_timestamp[symbol_col])
+            y_times = pd.DatetimeIndex(y_timestamp[timestamp_col])
+            horizons = np.bincount(y_codes[y_codes >= 0], minlength=len(symbols))
+            if (y_codes < 0).any() or (horizons == 0).any():
+                raise ValueError("y_timestamp must list future timestamps for exactly the symbols of df.")
+            y_order = np.lexsort((y_times.asi8, y_codes))
+            pred_len = int(horizons.max())
+            y_valid = np.arange(pred_len) < horizons[:, np.newaxis]
+            y_index = (np.cumsum(horizons) - horizons)[:, np.newaxis] + np.arange(pred_len)
+            y_rows = y_order[np.where(y_valid, y_index, 0)]
+            y_times = y_times[y_rows.ravel()]
+            y_stamp = time_features(y_times).reshape(y_rows.shape + (-1,)) * y_valid[..., np.newaxis]
+            pred_len = pred_len if (horizons == pred_len).all() else horizons.tolist()
+        else:
+            y_times = pd.DatetimeIndex(y_timestamp)
+            pred_len = len(y_times)
+            if pred_len < 1:
+                raise ValueError("y_timestamp must hold at least one timestamp to forecast.")
+            y_valid = np.ones((len(symbols), pred_len), dtype=bool)
+            y_stamp = np.broadcast_to(time_features(y_times), (len(symbols), pred_len, len(self.time_cols)))
+            y_times = y_times[np.tile(np.arange(pred_len), len(symbols))]
+
+        preds = self.generate(x, x_stamp, y_stamp, pred_len, T, top_k, top_p, sample_count, verbose, padding_mask=padding_mask, seed=seed)
+        preds = preds * (x_std[:, np.newaxis] + 1e-5) + x_mean[:, np.newaxis]
+
+        pred_df = pd.DataFrame(preds[y_valid], columns=self.price_cols + [self.vol_col, self.amt_vol])
+        pred_df.insert(0, timestamp_col, y_times[y_valid.ravel()])
+        pred_df.insert(0, symbol_col, np.repeat(np.asarray(symbols), y_valid.sum(axis=1)))
+        return pred_df
+
+
+def _pool_worker(rank, tokenizer, model, predictor_kwargs, num_threads, cpus, seed, tasks, results):
+    """Worker process of `KronosPredictorPool`: runs `predict_batch` for every task until a None sentinel."""
+    try:
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(num_threads)
+        if seed is not None:
+            torch.manual_seed(seed + rank)
+        else:
+            torch.seed()
+        predictor = KronosPredictor(model, tokenizer, device="cpu", **predictor_kwargs)
+    except Exception as e:
+        results.put((None, rank, e))
+        return
+    results.put((None, rank, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, args = task
+        try:
+            results.put((task_id, predictor.predict_batch(*args), None))
+        except Exception as e:
+            results.put((task_id, None, e))
+
+
+class KronosPredictorPool:
+    """
+    Multi-process CPU inference: N worker processes, each running a `KronosPredictor` with its own pinned
+    intra-op thread count, on model weights that live once in shared memory. `predict_batch` shards the series
+    across the workers and returns the forecasts in input order.
+
+    Workers are started with `start_method` ("forkserver" by default, which avoids forking a parent whose
+    OpenMP threads are already running). As with any non-fork start method, scripts must create the pool
+    under `if __name__ == "__main__":`.
+    """
+
+    def __init__(self, model, tokenizer, num_workers=None, num_threads=None, pin_cpus=True, chunk_size=None, seed=None,
+                 start_method="forkserver", **predictor_kwargs):
+        """
+        Args:
+            model (Kronos): The Kronos model. Its weights are moved to shared memory in place.
+            tokenizer (KronosTokenizer): The tokenizer the model was trained with, shared the same way.
+            num_workers (int, optional): Number of worker processes. Defaults to one per num_threads cores.
+            num_threads (int, optional): Intra-op threads per worker. Defaults to the available cores divided
+                                         evenly over the workers (1 if num_workers is not given either).
+            pin_cpus (bool): Pin every worker to its own set of num_threads cores (Linux only).
+            chunk_size (int, optional): Series per task. Defaults to an even split over the workers.
+            seed (int, optional): Worker i seeds torch with seed + i. Defaults to None (random seeds).
+            start_method (str): multiprocessing start method of the workers.
+            **predictor_kwargs: Further `KronosPredictor` arguments (max_context, clip, rolling_cache, compile,
+                                quantize, precision, ...). quantize gives every worker its own int8 copy.
+        """
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        if num_workers is None:
+            num_threads = num_threads or 1
+            num_workers = max(1, len(cpus) // num_threads)
+        num_threads = num_threads or max(1, len(cpus) // num_workers)
+        if num_workers < 1 or num_threads < 1:
+            raise ValueError("num_workers and num_threads must be positive.")
+        pin_cpus = pin_cpus and hasattr(os, 'sched_setaffinity') and num_workers * num_threads <= len(cpus)
+
+        # Reduced precision is applied here so that the workers share the converted weights.
+        dtype = _PRECISIONS.get(predictor_kwargs.get('precision', 'fp32'))
+        model, tokenizer = model.cpu().eval(), tokenizer.cpu().eval()
+        if dtype is not None:
+            model, tokenizer = _half_precision_copy(model, dtype), _half_precision_copy(tokenizer, dtype)
+        model.share_memory()
+        tokenizer.share_memory()
+
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+        context = torch.multiprocessing.get_context(start_method)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = []
+        for rank in range(num_workers):
+            worker_cpus = cpus[rank * num_threads:(rank + 1) * num_threads] if pin_cpus else None
+            worker = context.Process(target=_pool_worker, daemon=True,
+                                     args=(rank, tokenizer, model, predictor_kwargs, num_threads, worker_cpus, seed, self._tasks, self._results))
+            worker.start()
+            self._workers.append(worker)
+
+        errors = [error for _, _, error in self._collect(num_workers) if error is not None]
+        if errors:
+            self.close()
+            raise errors[0]
+
+    def _collect(self, count):
+        """Receives count results, failing instead of blocking forever if a worker process died."""
+        received = []
+        while len(received) < count:
+            try:
+                received.append(self._results.get(timeout=1.0))
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    self.close()
+                    raise RuntimeError("A KronosPredictorPool worker process exited unexpectedly.")
+        return received
+
+    def predict_batch(self, df_list, x_timestamp_list, y_timestamp_list, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, tolerance=None,
+                      seed=None):
+        """
+        Sharded `KronosPredictor.predict_batch`: the series are split into chunks that the workers forecast in
+        parallel. Arguments and return value are those of `KronosPredictor.predict_batch`; pred_len, T, top_k,
+        top_p and seed may hold one value per series. With a seed, the forecasts do not depend on the chunking
+        or on the worker seeds.
+        """
+        if not self._workers:
+            raise RuntimeError("The pool has been closed.")
+        if not (len(df_list) == len(x_timestamp_list) == len(y_timestamp_list)):
+            raise ValueError("df_list, x_timestamp_list, y_timestamp_list must have consistent lengths.")
+
+        num_series = len(df_list)
+        chunk_size = self.chunk_size or max(1, -(-num_series // self.num_workers))
+        chunks = [slice(start, start + chunk_size) for start in range(0, num_series, chunk_size)]
+        for task_id, chunk in enumerate(chunks):
+            per_series = [list(v)[chunk] if np.ndim(v) > 0 else v for v in (pred_len, T, top_k, top_p, seed)]
+            self._tasks.put((task_id, (list(df_list[chunk]), list(x_timestamp_list[chunk]), list(y_timestamp_list[chunk]),
+                                       *per_series[:4], sample_count, False, tolerance, per_series[4])))
+
+        # All results are received before raising, so that none is left over for the next call.
+        results = [None] * len(chunks)
+        errors = []
+        for task_id, pred_dfs, error in self._collect(len(chunks)):
+            results[task_id] = pred_dfs
+            if error is not None:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+        return [pred_df for pred_dfs in results for pred_df in pred_dfs]
+
+    def close(self):
+        """Stops the worker processes."""
+        for worker in self._workers:
+            if worker.is_alive():
+                self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _ScheduledForecast:
+    """A forecast request of `KronosScheduler` and its decoding progress."""
+
+    def __init__(self, x, x_stamp, y_stamp, y_timestamp, x_mean, x_std, pred_len, T, top_k, top_p, sample_count, seed, loop, future):
+        self.x, self.x_stamp, self.y_stamp = x, x_stamp, y_stamp
+        self.y_timestamp, self.x_mean, self.x_std = y_timestamp, x_mean, x_std
+        self.pred_len, self.T, self.top_k, self.top_p, self.sample_count, self.seed = pred_len, T, top_k, top_p, sample_count, seed
+        self.loop, self.future = loop, future
+        self.z = []  # decoded steps, each of shape [sample_count, 1, d_in]
+
+    def resolve(self, result=None, error=None):
+        """Completes the awaiting future from the decoding thread."""
+        def complete():
+            if not self.future.done():
+                if error is not None:
+                    self.future.set_exception(error)
+                else:
+                    self.future.set_result(result)
+        try:
+            self.loop.call_soon_threadsafe(complete)
+        except RuntimeError:
+            pass  # the event loop of the caller has been closed
+
+
+class KronosScheduler:
+    """
+    Continuous batching of concurrent forecasts. Requests submitted from asyncio code join the running decode
+    batch at the next step boundary and leave it as soon as their horizon is reached, instead of every `predict`
+    call running to completion on its own.
+
+    Decoding runs on a background thread. All rows of the batch share one right-aligned KV cache timeline:
+    joining requests are prefilled together, left-padded as in `KronosPredictor.predict_batch`, and merged into
+    the running caches (`Kronos.merge_kv_caches`). The caches keep a rolling window of the last max_context
+    positions, so forecasts running past max_context behave like `rolling_cache=True`.
+
+    Example:
+        async with KronosScheduler(predictor) as scheduler:
+            pred_df = await scheduler.submit(df, x_timestamp, y_timestamp, pred_len=120)
+    """
+
+    def __init__(self, predictor, max_batch_size=256):
+        """
+        Args:
+            predictor (KronosPredictor): Provides the model, tokenizer, device, precision, max_context and clip.
+                                         The scheduler decodes with its eager (possibly quantized or reduced
+                                         precision) modules; compiled graphs are not used.
+            max_batch_size (int): Maximum number of sampled rows (requests times sample_count) per decoding step.
+                                  Further requests wait until running ones finish.
+        """
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self._pending = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="KronosScheduler", daemon=True)
+        self._thread.start()
+
+    async def submit(self, df, x_timestamp, y_timestamp, pred_len, T=1.0, top_k=0, top_p=0.9, sample_count=1, seed=None):
+        """
+        Forecasts a single series within the shared decode batch. Arguments and return value are those of
+        `KronosPredictor.predict`; with a seed, the forecast does not depend on the other requests in the batch.
+        """
+        if self._closed:
+            raise RuntimeError("The scheduler has been closed.")
+        if sample_count > self.max_batch_size:
+            raise ValueError(f"sample_count ({sample_count}) exceeds max_batch_size ({self.max_batch_size}).")
+        x, x_stamp, y_stamp, x_mean, x_std = self.predictor._prepare_input(df, x_timestamp, y_timestamp)
+        if pred_len < 1 or y_stamp.shape[1] != pred_len:
+            raise ValueError(f"y_timestamp length should equal pred_len={pred_len} >= 1, got {y_stamp.shape[1]}.")
+
+        device = self.predictor.device
+        loop = asyncio.get_running_loop()
+        request = _ScheduledForecast(torch.from_numpy(x[0]).to(device), torch.from_numpy(x_stamp[0]).to(device),
+                                     torch.from_numpy(y_stamp[0]).to(device), y_timestamp, x_mean, x_std,
+                                     pred_len, T, top_k, top_p, sample_count, seed, loop, loop.create_future())
+        self._pending.put(request)
+        return await request.future
+
+    def _prefill(self, requests):
+        """Prefills the contexts of the joining requests in one left-padded batch and replicates them per sample."""
+        predictor = self.predictor
+        max_context = predictor.max_context
+        xs = [r.x for r in requests]
+        seq_len = max(len(x) for x in xs)
+        x = torch.stack([F.pad(x, (0, 0, seq_len - len(x), 0)) for x in xs])
+        x_stamp = torch.stack([F.pad(r.x_stamp, (0, 0, seq_len - len(r.x_stamp), 0)) for r in requests])
+        padding_mask = None
+        if any(len(x) != seq_len for x in xs):
+            lengths = torch.tensor([len(x) for x in xs], device=x.device)
+            padding_mask = torch.arange(seq_len, device=x.device)[None, :] < (seq_len - lengths)[:, None]
+
+        # As in `auto_regressive_stream`, the whole history is encoded (the tokenizer encoder is causal,
+        # so cutting it first would change the context tokens) and only the last max_context are prefilled.
+        tokens = [t[:, -max_context:] for t in predictor.tokenizer.encode(x, half=True, padding_mask=padding_mask)]
+        x_stamp = x_stamp[:, -max_context:]
+        if padding_mask is not None:
+            padding_mask = padding_mask[:, -max_context:]
+        kv_cache = predictor.model.new_kv_cache(max_context)
+        s1_logits, context = predictor.model.decode_s1(tokens[0], tokens[1], x_stamp, padding_mask=padding_mask, kv_cache=kv_cache, last_only=True)
+        decoder_cache = predictor.tokenizer.new_kv_cache(max_context)
+        predictor.tokenizer.decode(tokens, half=True, kv_cache=decoder_cache, padding_mask=padding_mask)
+
+        repeats = torch.tensor([r.sample_count for r in requests], device=x.device)
+        for cache in kv_cache['transformer'] + [kv_cache['dep_layer']] + decoder_cache:
+            cache.repeat_interleave(repeats)
+        return kv_cache, decoder_cache, s1_logits[:, -1].repeat_interleave(repeats, dim=0), context[:, -1:].repeat_interleave(repeats, dim=0)
+
+    def _run(self):
+        """Decoding loop of the background thread."""
+        predictor = self.predictor
+        waiting = collections.deque()
+        active, kv_cache, decoder_cache, s1_logits, context = [], None, None, None, None
+        stopping = False
+        while True:
+            # Admit the requests that have arrived since the last step, blocking while there is nothing to do.
+            while True:
+                try:
+                    request = self._pending.get(block=not (active or waiting or stopping))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                else:
+                    waiting.append(request)
+            if stopping and not (active or waiting):
+                return
+            joining = []
+            rows = sum(r.sample_count for r in active)
+            while waiting and rows + waiting[0].sample_count <= self.max_batch_size:
+                rows += waiting[0].sample_count
+                joining.append(waiting.popleft())
+
+            if joining:
+                # A failing prefill (e.g. an invalid context) only fails the joining requests; merging builds new caches.
+                try:
+                    with torch.no_grad(), predictor._autocast():
+                        new_state = self._prefill(joining)
+                        if active:
+                            new_state = (predictor.model.merge_kv_caches([kv_cache, new_state[0]]),
+                                         predictor.tokenizer.merge_kv_caches([decoder_cache, new_state[1]]),
+                                         torch.cat([s1_logits, new_state[2]]), torch.cat([context, new_state[3]]))
+                except Exception as error:
+                    for r in joining:
+                        r.resolve(error=error)
+                    continue
+                kv_cache, decoder_cache, s1_logits, context = new_state
+                active = active + joining
+
+            try:
+                with torch.no_grad(), predictor._autocast():
+                    device = s1_logits.device
+                    T, top_k, top_p = (torch.tensor([getattr(r, name) for r in active for _ in range(r.sample_count)], dtype=dtype, device=device)
+                                       for name, dtype in (('T', torch.float32), ('top_k', torch.long), ('top_p', torch.float32)))
+                    uniforms = torch.rand(2, s1_logits.size(0), device=device)
+                    if any(r.seed is not None for r in active):
+                        # Seeded rows draw the counter-based numbers `auto_regressive_stream` would give them
+                        seeded, seeds, samples, steps = (torch.tensor(v, device=device) for v in zip(*(
+                            (r.seed is not None, r.seed or 0, j, len(r.z)) for r in active for j in range(r.sample_count))))
+                        uniforms = torch.where(seeded, counter_uniforms(seeds, samples, steps), uniforms)
+                    sample_pre = sample_from_logits(s1_logits, temperature=T, top_k=top_k, top_p=top_p, sample_logits=True, uniforms=uniforms[0])
+                    s2_logits = predictor.model.decode_s2(context, sample_pre, kv_cache=kv_cache, last_only=True)
+                    sample_post = sample_from_logits(s2_logits[:, -1], temperature=T, top_k=top_k, top_p=top_p, sample_logits=True,
+                                                     uniforms=uniforms[1])
+                    z = predictor.tokenizer.decode([sample_pre, sample_post], half=True, kv_cache=decoder_cache)
+
+                    # Hand out the decoded step and retire the finished (or cancelled) requests.
+                    keep, remaining, row = [], [], 0
+                    for r in active:
+                        r.z.append(z[row:row + r.sample_count])
+                        if len(r.z) == r.pred_len or r.future.cancelled():
+                            self._finish(r)
+                        else:
+                            keep.append(torch.arange(row, row + r.sample_count, device=device))
+                            remaining.append(r)
+                        row += r.sample_count
+                    active = remaining
+                    if not active:
+                        kv_cache = decoder_cache = s1_logits = context = None
+                        continue
+                    if sum(len(k) for k in keep) < z.size(0):
+                        keep = torch.cat(keep)
+                        for cache in kv_cache['transformer'] + [kv_cache['dep_layer']] + decoder_cache:
+                            cache.select(keep)
+                        sample_pre, sample_post = sample_pre[keep], sample_post[keep]
+
+                    stamp = torch.cat([r.y_stamp[len(r.z) - 1:len(r.z)].expand(r.sample_count, -1) for r in active])[:, None, :]
+                    s1_logits, context = predictor.model.decode_s1(sample_pre, sample_post, stamp, kv_cache=kv_cache, last_only=True)
+                    s1_logits = s1_logits[:, -1]
+            except Exception as error:
+                for r in active:
+                    r.resolve(error=error)
+                active, kv_cache, decoder_cache, s1_logits, context = [], None, None, None, None
+
+    def _finish(self, request):
+        """Averages the samples of a completed request and hands the denormalized forecast to its caller."""
+        preds = torch.cat(request.z, dim=1).float().mean(dim=0).cpu().numpy()
+        preds = preds * (request.x_std + 1e-5) + request.x_mean
+        predictor = self.predictor
+        request.resolve(pd.DataFrame(preds, columns=predictor.price_cols + [predictor.vol_col, predictor.amt_vol], index=request.y_timestamp))
+
+    def close(self):
+        """Stops the decoding thread once the submitted forecasts are done."""
+        if not self._closed:
+            self._closed = True
+            self._pending.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
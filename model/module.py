@@ -227,17 +227,11 @@ class BSQuantizer(nn.Module):
         self.s1_bits = s1_bits
         self.s2_bits = s2_bits
         self.bsq = BinarySphericalQuantizer(self.codebook_dim, beta, gamma0, gamma, zeta, group_size=group_size)
+        self.register_buffer('bit_weights', 2 ** torch.arange(self.codebook_dim, dtype=torch.long), persistent=False)
 
     def bits_to_indices(self, bits):
         bits = (bits >= 0).to(torch.long)
-        indices = 2 ** torch.arange(
-            0,
-            bits.shape[-1],
-            1,
-            dtype=torch.long,
-            device=bits.device,
-        )
-        return (bits * indices).sum(-1)
+        return (bits * self.bit_weights[:bits.shape[-1]]).sum(-1)
 
     def forward(self, z, half=False):
         z = F.normalize(z, dim=-1)
@@ -250,19 +244,35 @@ class BSQuantizer(nn.Module):
             z_indices = self.bits_to_indices(quantized)
         return bsq_loss, quantized, z_indices
 
+    def encode_indices(self, z, half=False):
+        """
+        Inference path of `forward` that only returns z_indices.
+
+        The indices depend on the signs of z alone, so the normalization, the straight-through
+        estimator and the commit/entropy losses are skipped and the sign bits are packed directly.
+        """
+        bits = (z > 0).to(torch.long)
+        if half:
+            return [(bits[..., :self.s1_bits] * self.bit_weights[:self.s1_bits]).sum(-1),
+                    (bits[..., self.s1_bits:] * self.bit_weights[:self.s2_bits]).sum(-1)]
+        return (bits * self.bit_weights).sum(-1)
+
 
 class RMSNorm(torch.nn.Module):
     def __init__(self, dim: int, eps: float = 1e-5):
         super().__init__()
         self.eps = eps
         self.weight = nn.Parameter(torch.ones(dim))
+        self.use_fused_kernel = False  # set by `fuse_for_inference`
 
     def _norm(self, x):
-        return x * torch.rsqrt(torch.mean(x * x, dim=-1, keepdim=True) + self.eps)
+        # The statistic is accumulated in fp32; the normalization itself runs in the input dtype.
+        return x * torch.rsqrt(torch.mean(x.float().square(), dim=-1, keepdim=True) + self.eps).type_as(x)
 
     def forward(self, x):
-        output = self._norm(x.float()).type_as(x)
-        return output * self.weight
+        if self.use_fused_kernel:
+            return F.rms_norm(x, self.weight.shape, self.weight.to(x.dtype), self.eps)
+        return self._norm(x) * self.weight
 
 
 class FeedForward(nn.Module):
@@ -273,37 +283,357 @@ class FeedForward(nn.Module):
         self.w3 = nn.Linear(d_model, ff_dim, bias=False)
         self.w2 = nn.Linear(ff_dim, d_model, bias=False)
         self.ffn_dropout = nn.Dropout(ffn_dropout_p)
+        self.w13 = None  # w1 and w3 stacked into one projection by `fuse`
+
+    def fuse(self):
+        """Replaces w1/w3 by a single w13 projection for inference (one GEMM instead of two)."""
+        if self.w13 is None:
+            self.w13 = fuse_linear([self.w1, self.w3])
+            del self.w1, self.w3
 
     def forward(self, x):
+        if self.w13 is not None:
+            x1, x3 = self.w13(x).chunk(2, dim=-1)
+            return self.ffn_dropout(self.w2(F.silu(x1) * x3))
         return self.ffn_dropout(self.w2(F.silu(self.w1(x)) * self.w3(x)))
 
 
+def fuse_linear(layers):
+    """Stacks nn.Linear layers with the same input into one nn.Linear whose output is their concatenated outputs."""
+    has_bias = layers[0].bias is not None
+    weight = layers[0].weight
+    fused = nn.Linear(weight.size(1), sum(layer.out_features for layer in layers), bias=has_bias, device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        fused.weight.copy_(torch.cat([layer.weight for layer in layers], dim=0))
+        if has_bias:
+            fused.bias.copy_(torch.cat([layer.bias for layer in layers], dim=0))
+    return fused
+
+
+def fuse_for_inference(module):
+    """
+    One-time inference transformation of `module` in place: the q/k/v projections of every
+    MultiHeadAttentionWithRoPE and the w1/w3 projections of every FeedForward are merged into one GEMM each,
+    HierarchicalEmbedding folds its fusion projection into its embedding tables, RMSNorm switches to the fused
+    F.rms_norm kernel where available, and nn.Dropout modules are replaced by nn.Identity. The fused module has
+    a different state_dict and is meant for inference only.
+    """
+    for name, child in list(module.named_modules()):
+        if isinstance(child, (MultiHeadAttentionWithRoPE, FeedForward, HierarchicalEmbedding)):
+            child.fuse()
+        elif isinstance(child, RMSNorm):
+            child.use_fused_kernel = hasattr(F, 'rms_norm')
+        elif isinstance(child, nn.Dropout):
+            parent_name, _, attr = name.rpartition('.')
+            setattr(module.get_submodule(parent_name), attr, nn.Identity())
+    return module.eval()
+
+
+def cast_parameters(module, dtype, keep=()):
+    """
+    Casts the parameters of `module` to dtype in place, except those whose name starts with one of the
+    prefixes in `keep`. Unlike `module.to(dtype)`, buffers (e.g. the rotary inv_freq) keep their dtype.
+    """
+    keep = tuple(keep)
+    for name, param in module.named_parameters():
+        if not (keep and name.startswith(keep)):
+            param.data = param.data.to(dtype)
+    return module
+
+
+_SAFETENSORS_DTYPES = {'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16}
+
+
+def cast_parameters_to_checkpoint(module, model_file):
+    """
+    Casts the parameters of `module` in place to the floating point dtype they are stored with in the safetensors
+    file model_file, so that loading it keeps e.g. a bf16 checkpoint in bf16 instead of upcasting it to the dtype
+    the module was built with. Only the file header is read.
+    """
+    from safetensors import safe_open
+    with safe_open(model_file, framework="pt") as f:
+        stored = {name: f.get_slice(name).get_dtype() for name in f.keys()}
+    for name, param in module.named_parameters():
+        dtype = _SAFETENSORS_DTYPES.get(stored.get(name))
+        if dtype is not None and param.dtype != dtype:
+            param.data = param.data.to(dtype)
+    return module
+
+
+class KVCache:
+    """
+    Key/value cache of a single attention layer for incremental decoding.
+
+    Keys are cached after the rotary embedding has been applied, so a cached forward
+    pass only has to project and rotate the newly appended positions.
+
+    With a `capacity`, the buffers are allocated once for that many positions and new positions are
+    written in place; without one, they grow by concatenation.
+
+    With `max_len`, the cache keeps a rolling window of the most recent `max_len` positions. Rotary
+    attention scores only depend on the distance between query and key positions, so evicting the
+    oldest positions needs no re-rotation of the remaining keys: new positions keep counting from
+    `offset`, the total number of positions ever appended. Once the window is full, a single new
+    position overwrites the slot of the oldest one, so the cached keys are no longer in position
+    order. Single-position queries do not depend on that order.
+    """
+
+    def __init__(self, max_len=None, capacity=None):
+        self.max_len = max_len
+        if max_len is not None:
+            capacity = max_len if capacity is None else min(capacity, max_len)
+        self.capacity = capacity
+        self.k = None
+        self.v = None
+        self.pad = None  # [batch, 1, len, 1] padding flags, only kept once a padding mask was appended
+        self.length = 0  # number of valid positions
+        self.start = 0  # slot of the oldest position once a rolling window is full
+        self.offset = 0
+
+    def __len__(self):
+        return self.length
+
+    def get(self):
+        """Returns the cached k, v of shape [batch, n_heads, len, head_dim]."""
+        return self.k[:, :, :self.length], self.v[:, :, :self.length]
+
+    def _buffers(self):
+        return {'k': self.k, 'v': self.v, 'pad': self.pad} if self.pad is not None else {'k': self.k, 'v': self.v}
+
+    def update(self, k, v, key_padding_mask=None):
+        """
+        Appends k, v of shape [batch, n_heads, new_len, head_dim] and returns the full cached k, v.
+        key_padding_mask ([batch, new_len], True for padding) marks padded new positions; the cache keeps
+        these flags for `key_padding_mask`.
+        """
+        new_len = k.size(-2)
+        self.offset += new_len
+        new = {'k': k, 'v': v}
+        if key_padding_mask is not None or self.pad is not None:
+            if key_padding_mask is None:
+                key_padding_mask = torch.zeros(k.size(0), new_len, dtype=torch.bool, device=k.device)
+            new['pad'] = key_padding_mask.bool()[:, None, :, None]
+            if self.pad is None and self.k is not None:
+                self.pad = torch.zeros_like(self.k[:, :1, :, :1], dtype=torch.bool)
+
+        if self.capacity is None:
+            for name, x in new.items():
+                old = getattr(self, name)
+                setattr(self, name, x if old is None else torch.cat([old, x], dim=-2))
+            self.length = self.k.size(-2)
+            return self.get()
+
+        if self.k is None:
+            for name, x in new.items():
+                shape = list(x.shape)
+                shape[-2] = self.capacity
+                setattr(self, name, x.new_empty(shape))
+
+        buffers = self._buffers()
+        if self.length + new_len <= self.capacity:
+            for name, x in new.items():
+                buffers[name][:, :, self.length:self.length + new_len] = x
+            self.length += new_len
+        elif self.max_len is not None and self.capacity == self.max_len and new_len == 1:
+            # Window full: overwrite the oldest position
+            for name, x in new.items():
+                buffers[name][:, :, self.start:self.start + 1] = x
+            self.start = (self.start + 1) % self.capacity
+        elif self.max_len is not None and self.capacity == self.max_len:
+            # Multi-position update past the window: restore position order and keep the last max_len positions
+            for name, x in new.items():
+                x = torch.cat([buffers[name][:, :, :self.length].roll(-self.start, dims=-2), x], dim=-2)[:, :, -self.capacity:]
+                buffers[name][:, :, :x.size(-2)] = x
+            self.length = min(self.length + new_len, self.capacity)
+            self.start = 0
+        else:
+            raise ValueError(f"KVCache capacity of {self.capacity} positions exceeded.")
+        return self.get()
+
+    def key_padding_mask(self):
+        """Returns the padding mask [batch, len] of the cached positions (True for padding), or None if none was appended."""
+        return None if self.pad is None else self.pad[:, 0, :self.length, 0]
+
+    def truncate(self, length):
+        """Keeps only the first `length` positions, e.g. to drop the right padding of a prefill. Not valid once a rolling window has wrapped."""
+        self.offset -= self.length - length
+        self.length = length
+        if self.capacity is None:
+            for name, buffer in self._buffers().items():
+                setattr(self, name, buffer[:, :, :length])
+
+    def repeat_interleave(self, repeats):
+        """Repeats every cached batch row `repeats` times, e.g. to share a prefilled prefix across sample replicas."""
+        if self.k is not None:
+            for name, buffer in self._buffers().items():
+                setattr(self, name, buffer.repeat_interleave(repeats, dim=0))
+
+    def select(self, index):
+        """Keeps only the batch rows in `index`, e.g. to retire finished rows from a generation batch."""
+        if self.k is not None:
+            for name, buffer in self._buffers().items():
+                setattr(self, name, buffer.index_select(0, index))
+
+    @classmethod
+    def merge(cls, caches, rotary=None):
+        """
+        Concatenates the batch rows of several prefilled caches into a new cache, e.g. to let new sequences join
+        a running generation batch. The caches are right-aligned: shorter ones are left-padded with positions
+        flagged as padding, and with the `rotary` embedding of the owning attention layer the cached keys are
+        re-rotated so that the positions of every cache end at the same offset.
+        """
+        length = max(cache.length for cache in caches)
+        merged = cls(caches[0].max_len, caches[0].capacity)
+        parts = {'k': [], 'v': [], 'pad': []}
+        for cache in caches:
+            k, v = cache.get()
+            pad = cache.key_padding_mask()
+            if pad is None:
+                pad = torch.zeros(k.size(0), cache.length, dtype=torch.bool, device=k.device)
+            if cache.start:
+                k, v, pad = k.roll(-cache.start, dims=-2), v.roll(-cache.start, dims=-2), pad.roll(-cache.start, dims=-1)
+            if rotary is not None and cache.offset != length:
+                k = rotary.shift(k, length - cache.offset)
+            missing = length - cache.length
+            parts['k'].append(F.pad(k, (0, 0, missing, 0)))
+            parts['v'].append(F.pad(v, (0, 0, missing, 0)))
+            parts['pad'].append(F.pad(pad, (missing, 0), value=True)[:, None, :, None])
+
+        for name, x in parts.items():
+            x = torch.cat(x, dim=0)
+            if merged.capacity is not None:
+                shape = list(x.shape)
+                shape[-2] = merged.capacity
+                buffer = x.new_empty(shape)
+                buffer[:, :, :length] = x
+                x = buffer
+            setattr(merged, name, x)
+        merged.length = merged.offset = length
+        return merged
+
+
+class StaticKVCache:
+    """
+    Fixed-shape key/value cache for compiled single-step decoding, built from a prefilled KVCache.
+
+    The buffers always span `capacity` slots and the number of positions appended so far is kept in a
+    tensor, so every decoding step runs with the same shapes and without Python-level state that a
+    compiled graph would have to guard on. Position p is written to slot p % capacity, which turns the
+    buffers into a rolling window once they are full; slots that were never written are masked out as
+    padding through `key_padding_mask`. Like a full KVCache window, the slots are then no longer in
+    position order, so only single-position updates are supported.
+
+    `length` counts the appended positions on the Python side. The graphs do not read it: callers
+    advance it after each step, e.g. to size the rotary tables.
+    """
+
+    def __init__(self, cache):
+        k, v = cache.get()
+        if cache.start:
+            k, v = k.roll(-cache.start, dims=-2), v.roll(-cache.start, dims=-2)  # back into position order
+        shape = list(k.shape)
+        shape[-2] = cache.capacity
+        self.capacity = cache.capacity
+        self.k, self.v = k.new_zeros(shape), v.new_zeros(shape)
+        slots = torch.arange(cache.offset - cache.length, cache.offset, device=k.device) % self.capacity
+        self.k.index_copy_(2, slots, k)
+        self.v.index_copy_(2, slots, v)
+        # Padding flags per slot, always allocated so that padded and unpadded batches share the graphs
+        self.pad = torch.zeros(k.size(0), self.capacity, dtype=torch.bool, device=k.device)
+        pad = cache.key_padding_mask()
+        if pad is not None:
+            self.pad.index_copy_(1, slots, pad.roll(-cache.start, dims=-1) if cache.start else pad)
+        self.position = torch.full((1,), cache.offset, dtype=torch.long, device=k.device)
+        self.length = cache.offset
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def offset(self):
+        return self.position
+
+    def get(self):
+        """Returns the k, v buffers of shape [batch, n_heads, capacity, head_dim]."""
+        return self.k, self.v
+
+    def update(self, k, v, key_padding_mask=None):
+        """
+        Writes the single new position in k, v of shape [batch, n_heads, 1, head_dim] and returns the buffers.
+        key_padding_mask ([batch, 1]) flags the new position as padding.
+        """
+        if k.size(-2) != 1:
+            raise ValueError("StaticKVCache only appends one position at a time.")
+        slot = self.position % self.capacity
+        self.k.index_copy_(2, slot, k)
+        self.v.index_copy_(2, slot, v)
+        self.pad.index_copy_(1, slot, key_padding_mask.bool() if key_padding_mask is not None else self.pad.new_zeros(k.size(0), 1))
+        self.position += 1
+        return self.k, self.v
+
+    def key_padding_mask(self):
+        """Returns the padding mask [batch, capacity] of the slots: padded positions and slots that were never written."""
+        return self.pad | (torch.arange(self.capacity, device=self.position.device) >= self.position)
+
+    def select(self, index):
+        """Keeps only the batch rows in `index`."""
+        self.k, self.v, self.pad = self.k.index_select(0, index), self.v.index_select(0, index), self.pad.index_select(0, index)
+
+
+# cos/sin tables shared by every RotaryPositionalEmbedding with the same (head_dim, device, dtype).
+_ROTARY_TABLES = {}
+
+
 class RotaryPositionalEmbedding(nn.Module):
+    # Positions precomputed per table; covers the max_context of all released models. Longer sequences
+    # (e.g. a rolling KV cache) grow the shared table.
+    table_len = 2048
+
     def __init__(self, dim):
         super().__init__()
+        self.dim = dim
         inv_freq = 1.0 / (10000 ** (torch.arange(0, dim, 2).float() / dim))
         self.register_buffer("inv_freq", inv_freq)
-        self.seq_len_cached = None
-        self.cos_cached = None
-        self.sin_cached = None
-
-    def _update_cos_sin_cache(self, x, seq_len):
-        if seq_len != self.seq_len_cached:
-            self.seq_len_cached = seq_len
-            t = torch.arange(seq_len, device=x.device).type_as(self.inv_freq)
-            freqs = torch.einsum('i,j->ij', t, self.inv_freq)
-            emb = torch.cat((freqs, freqs), dim=-1).to(x.device)
-            self.cos_cached = emb.cos()[None, None, :, :]
-            self.sin_cached = emb.sin()[None, None, :, :]
-        return self.cos_cached, self.sin_cached
-
-    def forward(self, q, k):
-        cos, sin = self._update_cos_sin_cache(q, q.shape[-2])
+
+    def _get_cos_sin_table(self, x, seq_len):
+        key = (self.dim, x.device, x.dtype)
+        table = _ROTARY_TABLES.get(key)
+        if table is None or table[0].size(-2) < seq_len:
+            table_len = max(seq_len, self.table_len, 2 * table[0].size(-2) if table is not None else 0)
+            # Created outside inference mode so that a table built during inference can be reused for training.
+            # Positions and angles are always computed in fp32, only the finished table is cast to x.dtype.
+            with torch.inference_mode(False):
+                inv_freq = self.inv_freq.to(x.device, torch.float32)
+                t = torch.arange(table_len, device=x.device, dtype=torch.float32)
+                freqs = torch.einsum('i,j->ij', t, inv_freq)
+                emb = torch.cat((freqs, freqs), dim=-1)
+                table = (emb.cos()[None, None, :, :].to(x.dtype), emb.sin()[None, None, :, :].to(x.dtype))
+            _ROTARY_TABLES[key] = table
+        return table
+
+    def forward(self, q, k, offset=0):
+        seq_len = q.shape[-2]
+        if torch.is_tensor(offset):
+            # Position held in a tensor (StaticKVCache); the shared table must already cover it.
+            cos, sin = self._get_cos_sin_table(q, seq_len)
+            positions = offset + torch.arange(seq_len, device=q.device)
+            cos, sin = cos.index_select(2, positions), sin.index_select(2, positions)
+        else:
+            cos, sin = self._get_cos_sin_table(q, offset + seq_len)
+            cos, sin = cos[:, :, offset:offset + seq_len], sin[:, :, offset:offset + seq_len]
         return (
             (q * cos) + (self._rotate_half(q) * sin),
             (k * cos) + (self._rotate_half(k) * sin),
         )
 
+    def shift(self, x, delta):
+        """Moves already rotated keys or queries x by delta positions (which may be negative)."""
+        cos, sin = self._get_cos_sin_table(x, abs(delta) + 1)
+        cos, sin = cos[:, :, abs(delta):abs(delta) + 1], sin[:, :, abs(delta):abs(delta) + 1]
+        if delta < 0:
+            sin = -sin
+        return (x * cos) + (self._rotate_half(x) * sin)
+
     def _rotate_half(self, x):
         x1, x2 = x.chunk(2, dim=-1)
         return torch.cat((-x2, x1), dim=-1)
@@ -315,8 +645,8 @@ def scaled_dot_product_attention(query, key, value, attn_mask=None, dropout_p=0.
     attn_bias = torch.zeros(L, S, dtype=query.dtype).to(query.device)
 
     if is_causal:
-        assert attn_mask is None
-        temp_mask = torch.ones(L, S, dtype=torch.bool).tril(diagonal=0).to(query.device)
+        # Queries are the last L of the S key positions (L < S when decoding with a KV cache).
+        temp_mask = torch.ones(L, S, dtype=torch.bool).tril(diagonal=S - L).to(query.device)
         attn_bias.masked_fill_(temp_mask.logical_not(), float("-inf"))
         attn_bias.to(query.dtype)
 
@@ -336,6 +666,44 @@ def scaled_dot_product_attention(query, key, value, attn_mask=None, dropout_p=0.
     return attn_weight @ value
 
 
+def attention_mask(key_padding_mask, q_len, k_len, is_causal, device):
+    """
+    Merges key padding and causality into one boolean mask of the keys every query may attend (True), shaped
+    [batch, 1, q_len, k_len] (or [q_len, k_len] without padding), or None if every query may attend every key.
+
+    key_padding_mask: [batch, k_len], True (non-zero) for padded keys.
+    With is_causal, the queries are the last q_len of the k_len key positions. Every query may then also attend
+    to its own position, so that left-padded queries, which see only padding, do not get an all-masked row.
+    """
+    attn_mask = None
+    if key_padding_mask is not None:
+        attn_mask = (key_padding_mask == 0)[:, None, None, :]
+    if is_causal and q_len > 1:  # a single query at the last position sees every key
+        causal_mask = torch.ones(q_len, k_len, dtype=torch.bool, device=device).tril(diagonal=k_len - q_len)
+        if attn_mask is not None:
+            own_position = torch.ones(q_len, k_len, dtype=torch.bool, device=device).triu(diagonal=k_len - q_len) & causal_mask
+            attn_mask = (attn_mask & causal_mask) | own_position
+        else:
+            attn_mask = causal_mask
+    return attn_mask
+
+
+def fused_scaled_dot_product_attention(query, key, value, key_padding_mask=None, dropout_p=0.0, is_causal=False) -> torch.Tensor:
+    """
+    Attention through PyTorch's fused F.scaled_dot_product_attention, which dispatches to the flash,
+    memory-efficient or math kernel. `scaled_dot_product_attention` above is the reference implementation.
+
+    key_padding_mask: [batch, k_len], True (non-zero) for padded keys. It is passed on as a broadcastable
+        [batch, 1, 1, k_len] boolean mask rather than an expanded [batch, n_heads, q_len, k_len] bias,
+        merged with the causal mask as in `attention_mask`.
+    """
+    L, S = query.size(-2), key.size(-2)
+    if is_causal and key_padding_mask is None and L == S and L > 1:
+        return F.scaled_dot_product_attention(query, key, value, dropout_p=dropout_p, is_causal=True)
+    attn_mask = attention_mask(key_padding_mask, L, S, is_causal, query.device)
+    return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, dropout_p=dropout_p)
+
+
 class MultiHeadAttentionWithRoPE(nn.Module):
     def __init__(self, d_model, n_heads, attn_dropout_p=0.0, resid_dropout_p=0.0):
         super().__init__()
@@ -349,29 +717,51 @@ class MultiHeadAttentionWithRoPE(nn.Module):
         self.out_proj = nn.Linear(d_model, d_model)
         self.rotary = RotaryPositionalEmbedding(self.head_dim)
         self.attn_dropout_p = attn_dropout_p
+        self.use_fused_attention = hasattr(F, 'scaled_dot_product_attention')  # False: reference implementation
         self.resid_dropout = nn.Dropout(resid_dropout_p)
+        self.qkv_proj = None  # q/k/v projections stacked into one by `fuse`
 
-    def forward(self, x, key_padding_mask=None):
-        batch_size, seq_len, _ = x.shape
-
-        q = self.q_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
-        k = self.k_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
-        v = self.v_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+    def fuse(self):
+        """Replaces q_proj/k_proj/v_proj by a single qkv_proj for inference (one GEMM instead of three)."""
+        if self.qkv_proj is None:
+            self.qkv_proj = fuse_linear([self.q_proj, self.k_proj, self.v_proj])
+            del self.q_proj, self.k_proj, self.v_proj
 
-        q, k = self.rotary(q, k)
+    def forward(self, x, key_padding_mask=None, kv_cache=None):
+        """
+        x: [batch, seq_len, d_model]
+        key_padding_mask: [batch, seq_len], True for padded positions of x; a kv_cache keeps the flags of earlier positions
+        kv_cache: optional KVCache or StaticKVCache; x then holds only the new positions, which are appended to the cache
+        """
+        batch_size, seq_len, _ = x.shape
 
-        if key_padding_mask is not None:
-            attn_mask = key_padding_mask.unsqueeze(1).unsqueeze(2)  # [batch, 1, 1, seq_len]
-            attn_mask = attn_mask.expand(-1, self.n_heads, seq_len, -1)  # [batch, n_heads, q_len, k_len]
+        if self.qkv_proj is not None:
+            q, k, v = self.qkv_proj(x).view(batch_size, seq_len, 3, self.n_heads, self.head_dim).permute(2, 0, 3, 1, 4)
         else:
-            attn_mask = None
-
-        attn_output = scaled_dot_product_attention(
-            q, k, v,
-            attn_mask=attn_mask,
-            dropout_p=self.attn_dropout_p,
-            is_causal=True
-        )
+            q = self.q_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+            k = self.k_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+            v = self.v_proj(x).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+
+        offset = kv_cache.offset if kv_cache is not None else 0
+        q, k = self.rotary(q, k, offset)
+        if kv_cache is not None:
+            k, v = kv_cache.update(k, v, key_padding_mask)
+            key_padding_mask = kv_cache.key_padding_mask()
+
+        if self.use_fused_attention:
+            attn_output = fused_scaled_dot_product_attention(
+                q, k, v,
+                key_padding_mask=key_padding_mask,
+                dropout_p=self.attn_dropout_p if self.training else 0.0,
+                is_causal=True
+            )
+        else:
+            attn_mask = attention_mask(key_padding_mask, seq_len, k.size(-2), True, q.device)
+            attn_output = scaled_dot_product_attention(
+                q, k, v,
+                attn_mask=attn_mask.logical_not() if attn_mask is not None else None,  # True = masked
+                dropout_p=self.attn_dropout_p if self.training else 0.0
+            )
 
         attn_output = attn_output.transpose(1, 2).contiguous().view(batch_size, seq_len, self.d_model)
         return self.resid_dropout(self.out_proj(attn_output))
@@ -390,32 +780,52 @@ class MultiHeadCrossAttentionWithRoPE(nn.Module):
         self.out_proj = nn.Linear(d_model, d_model)
         self.rotary = RotaryPositionalEmbedding(self.head_dim)
         self.attn_dropout_p = attn_dropout_p
+        self.use_fused_attention = hasattr(F, 'scaled_dot_product_attention')  # False: reference implementation
         self.resid_dropout = nn.Dropout(resid_dropout)
 
-    def forward(self, query, key, value, key_padding_mask=None):
-        batch_size, q_len, _ = query.shape
-        _, seq_len, _ = key.shape
-
-        q = self.q_proj(query).view(batch_size, q_len, self.n_heads, self.head_dim).transpose(1, 2)
+    def extend_cache(self, key, value, kv_cache, key_padding_mask=None):
+        """Projects key/value [batch, seq_len, d_model] and appends them, with their padding flags, to kv_cache."""
+        batch_size, seq_len, _ = key.shape
         k = self.k_proj(key).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
         v = self.v_proj(value).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+        kv_cache.update(k, v, key_padding_mask)
 
-        q, k = self.rotary(q, k)
+    def forward(self, query, key, value, key_padding_mask=None, kv_cache=None):
+        """
+        kv_cache: optional KVCache filled by `extend_cache`; key/value and key_padding_mask are then ignored and
+            the query (a single position) attends to the cached projections and their padding flags. With a single
+            query position the rotary embedding reduces to position 0, i.e. the identity, which is why cached keys
+            are stored unrotated. Several query positions belong to the last q_len cached positions: query i
+            attends to the cached positions up to len - q_len + i, as it would have when decoded on its own.
+        """
+        batch_size, q_len, _ = query.shape
 
-        if key_padding_mask is not None:
-            attn_mask = key_padding_mask.unsqueeze(1).unsqueeze(2)
-            attn_mask = attn_mask.expand(-1, self.n_heads, q_len, -1)
+        q = self.q_proj(query).view(batch_size, q_len, self.n_heads, self.head_dim).transpose(1, 2)
+        if kv_cache is not None:
+            k, v = kv_cache.get()
+            key_padding_mask = kv_cache.key_padding_mask()
         else:
-            attn_mask = None
-
-        is_causal_flag = self.training
-
-        attn_output = scaled_dot_product_attention(
-            q, k, v,
-            attn_mask=attn_mask,
-            dropout_p=self.attn_dropout_p,
-            is_causal=is_causal_flag
-        )
+            _, seq_len, _ = key.shape
+            k = self.k_proj(key).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+            v = self.v_proj(value).view(batch_size, seq_len, self.n_heads, self.head_dim).transpose(1, 2)
+            q, k = self.rotary(q, k)
+
+        is_causal_flag = self.training or (kv_cache is not None and q_len > 1)
+
+        if self.use_fused_attention:
+            attn_output = fused_scaled_dot_product_attention(
+                q, k, v,
+                key_padding_mask=key_padding_mask,
+                dropout_p=self.attn_dropout_p if self.training else 0.0,
+                is_causal=is_causal_flag
+            )
+        else:
+            attn_mask = attention_mask(key_padding_mask, q_len, k.size(-2), is_causal_flag, q.device)
+            attn_output = scaled_dot_product_attention(
+                q, k, v,
+                attn_mask=attn_mask.logical_not() if attn_mask is not None else None,  # True = masked
+                dropout_p=self.attn_dropout_p if self.training else 0.0
+            )
 
         attn_output = attn_output.transpose(1, 2).contiguous().view(batch_size, q_len, self.d_model)
         return self.resid_dropout(self.out_proj(attn_output))
@@ -437,6 +847,24 @@ class HierarchicalEmbedding(nn.Module):
 
         nn.init.normal_(self.emb_s1.weight, mean=0, std=d_model ** -0.5)
         nn.init.normal_(self.emb_s2.weight, mean=0, std=d_model ** -0.5)
+        self.folded_s1 = self.folded_s2 = None  # emb_s1/emb_s2 folded through fusion_proj by `fuse`
+
+    def fuse(self):
+        """
+        Folds the sqrt(d_model) scaling and the linear fusion_proj into two lookup tables for inference, so
+        a token embeds as folded_s1[s1] + folded_s2[s2] without the per-token fusion matmul. emb_s1 is kept,
+        as it also embeds the sibling s1 token in `Kronos.decode_s2`.
+        """
+        if self.folded_s1 is None:
+            dtype = self.fusion_proj.weight.dtype
+            with torch.no_grad():
+                w_s1, w_s2 = self.fusion_proj.weight.double().split(self.d_model, dim=1)
+                scale = math.sqrt(self.d_model)
+                table_s1 = (self.emb_s1.weight.double() * scale) @ w_s1.T + self.fusion_proj.bias.double()
+                table_s2 = (self.emb_s2.weight.double() * scale) @ w_s2.T
+            self.folded_s1 = nn.Embedding.from_pretrained(table_s1.to(dtype))
+            self.folded_s2 = nn.Embedding.from_pretrained(table_s2.to(dtype))
+            del self.emb_s2, self.fusion_proj
 
     def forward(self, token_ids):
         """Inputs:
@@ -447,6 +875,8 @@ class HierarchicalEmbedding(nn.Module):
             s1_ids, s2_ids = token_ids
         else:
             s1_ids, s2_ids = self.split_token(token_ids, self.s2_bits)
+        if self.folded_s1 is not None:
+            return self.folded_s1(s1_ids) + self.folded_s2(s2_ids)
         s1_emb = self.emb_s1(s1_ids) * math.sqrt(self.d_model)
         s2_emb = self.emb_s2(s2_ids) * math.sqrt(self.d_model)
         return self.fusion_proj(torch.cat([s1_emb, s2_emb], dim=-1))
@@ -458,18 +888,26 @@ class DependencyAwareLayer(nn.Module):
         self.cross_attn = MultiHeadCrossAttentionWithRoPE(d_model, n_heads, attn_dropout_p, resid_dropout)
         self.norm = RMSNorm(d_model)
 
-    def forward(self, hidden_states, sibling_embed, key_padding_mask=None):
+    def forward(self, hidden_states, sibling_embed, key_padding_mask=None, kv_cache=None, last_only=False):
         """hidden_states: [batch, seq_len, d_model]
         sibling_embed: Embedding from another subtoken
+        kv_cache: optional KVCache holding the projections of all hidden_states (see `extend_cache`)
+        last_only: only compute the output of the final position (sibling_embed: [batch, 1, d_model])
         """
         attn_out = self.cross_attn(
             query=sibling_embed,
             key=hidden_states,
             value=hidden_states,
-            key_padding_mask=key_padding_mask
+            key_padding_mask=key_padding_mask,
+            kv_cache=kv_cache
         )
+        if last_only:
+            hidden_states = hidden_states[:, -1:, :]
         return self.norm(hidden_states + attn_out)
 
+    def extend_cache(self, hidden_states, kv_cache, key_padding_mask=None):
+        self.cross_attn.extend_cache(hidden_states, hidden_states, kv_cache, key_padding_mask)
+
 
 class TransformerBlock(nn.Module):
     def __init__(self, d_model, n_heads, ff_dim=1024, ffn_dropout_p=0.0, attn_dropout_p=0.0, resid_dropout_p=0.0):
@@ -479,10 +917,10 @@ class TransformerBlock(nn.Module):
         self.norm2 = RMSNorm(d_model)
         self.ffn = FeedForward(d_model, ff_dim, ffn_dropout_p)
 
-    def forward(self, x, key_padding_mask=None):
+    def forward(self, x, key_padding_mask=None, kv_cache=None):
         residual = x
         x = self.norm1(x)
-        attn_out = self.self_attn(x, key_padding_mask=key_padding_mask)
+        attn_out = self.self_attn(x, key_padding_mask=key_padding_mask, kv_cache=kv_cache)
         x = residual + attn_out
 
         residual = x
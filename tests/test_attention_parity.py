@@ -0,0 +1,102 @@
+import copy
+
+import pytest
+import torch
+
+from model.module import (KVCache, MultiHeadAttentionWithRoPE, MultiHeadCrossAttentionWithRoPE, fused_scaled_dot_product_attention,
+                          scaled_dot_product_attention)
+
+BATCH, N_HEADS, HEAD_DIM = 3, 4, 16
+
+
+def _qkv(q_len, k_len, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    q = torch.randn(BATCH, N_HEADS, q_len, HEAD_DIM, generator=generator)
+    k = torch.randn(BATCH, N_HEADS, k_len, HEAD_DIM, generator=generator)
+    v = torch.randn(BATCH, N_HEADS, k_len, HEAD_DIM, generator=generator)
+    return q, k, v
+
+
+@pytest.mark.parametrize("seq_len", [1, 7, 32])
+def test_causal(seq_len):
+    q, k, v = _qkv(seq_len, seq_len)
+    expected = scaled_dot_product_attention(q, k, v, is_causal=True)
+    actual = fused_scaled_dot_product_attention(q, k, v, is_causal=True)
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("q_len", [1, 3])
+def test_kv_cached(q_len):
+    # Decoding with a KV cache: the queries are the last q_len of the k_len key positions.
+    k_len = 12
+    q, k, v = _qkv(q_len, k_len)
+    expected = scaled_dot_product_attention(q, k, v, is_causal=True)
+    actual = fused_scaled_dot_product_attention(q, k, v, is_causal=True)
+    torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+
+    # Attending to the full sequence and keeping the last q_len rows gives the same result.
+    full_q = torch.cat([torch.randn(BATCH, N_HEADS, k_len - q_len, HEAD_DIM), q], dim=2)
+    full = fused_scaled_dot_product_attention(full_q, k, v, is_causal=True)
+    torch.testing.assert_close(actual, full[:, :, -q_len:], rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("q_len", [10, 4])
+def test_left_padded(q_len):
+    # Left padding of 0, 3 and 6 positions; with q_len < k_len the padded keys come from an earlier prefill.
+    k_len = 10
+    q, k, v = _qkv(q_len, k_len)
+    pad = torch.tensor([0, 3, 6])
+    key_padding_mask = torch.arange(k_len)[None, :] < pad[:, None]
+
+    # The reference takes padding and causality as one boolean mask (True = masked).
+    causal = torch.ones(q_len, k_len, dtype=torch.bool).tril(diagonal=k_len - q_len)
+    attn_mask = key_padding_mask[:, None, None, :] | ~causal
+    expected = scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+    actual = fused_scaled_dot_product_attention(q, k, v, key_padding_mask=key_padding_mask, is_causal=True)
+
+    # Queries on real positions match the reference. Padded queries attend only their own position instead
+    # of an all-masked row, where the reference gives NaN.
+    query_positions = torch.arange(k_len - q_len, k_len)
+    real = (query_positions[None, :] >= pad[:, None])[:, None, :, None].expand_as(actual)
+    torch.testing.assert_close(actual[real], expected[real], rtol=1e-5, atol=1e-5)
+    own_value = v[:, :, k_len - q_len:]
+    torch.testing.assert_close(actual[~real], own_value[~real], rtol=1e-5, atol=1e-5)
+
+
+def _reference(module):
+    reference = copy.deepcopy(module)
+    reference.use_fused_attention = False
+    return reference
+
+
+@torch.no_grad()
+@pytest.mark.parametrize("cached", [False, True])
+def test_module_fallback_with_padding(cached):
+    # In eval mode attention dropout is off on both paths, so a non-zero attn_dropout_p must not matter.
+    torch.manual_seed(0)
+    module = MultiHeadAttentionWithRoPE(32, 4, attn_dropout_p=0.5).eval()
+    reference = _reference(module)
+    x = torch.randn(3, 10, 32)
+    key_padding_mask = torch.arange(10)[None, :] < torch.tensor([0, 3, 6])[:, None]
+
+    outputs = []
+    for m in (module, reference):
+        if cached:
+            kv_cache = KVCache()
+            outputs.append(torch.cat([m(x[:, :7], key_padding_mask=key_padding_mask[:, :7], kv_cache=kv_cache)]
+                                     + [m(x[:, i:i + 1], key_padding_mask=key_padding_mask[:, i:i + 1], kv_cache=kv_cache) for i in range(7, 10)],
+                                     dim=1))
+        else:
+            outputs.append(m(x, key_padding_mask=key_padding_mask))
+    torch.testing.assert_close(outputs[1], outputs[0], rtol=1e-5, atol=1e-5)
+
+
+@torch.no_grad()
+def test_cross_attention_fallback_with_padding():
+    torch.manual_seed(0)
+    module = MultiHeadCrossAttentionWithRoPE(32, 4, attn_dropout_p=0.5).eval()
+    reference = _reference(module)
+    query, key = torch.randn(3, 10, 32), torch.randn(3, 10, 32)
+    key_padding_mask = torch.arange(10)[None, :] < torch.tensor([0, 3, 6])[:, None]
+    expected = reference(query, key, key, key_padding_mask=key_padding_mask)
+    torch.testing.assert_close(module(query, key, key, key_padding_mask=key_padding_mask), expected, rtol=1e-5, atol=1e-5)
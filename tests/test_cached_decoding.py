@@ -0,0 +1,76 @@
+import pytest
+import torch
+
+from model import Kronos, KronosTokenizer
+from model.kronos import auto_regressive_inference, counter_uniforms, sample_from_logits
+
+SEED = 7
+
+
+@pytest.fixture(scope="module")
+def models():
+    torch.manual_seed(0)
+    tokenizer = KronosTokenizer(d_in=6, d_model=32, n_heads=4, ff_dim=64, n_enc_layers=2, n_dec_layers=2, ffn_dropout_p=0.1,
+                                attn_dropout_p=0.1, resid_dropout_p=0.1, s1_bits=4, s2_bits=4, beta=0.05, gamma0=1.0,
+                                gamma=1.1, zeta=0.05, group_size=4).eval()
+    model = Kronos(s1_bits=4, s2_bits=4, n_layers=2, d_model=32, n_heads=4, ff_dim=64, ffn_dropout_p=0.1, attn_dropout_p=0.1,
+                   resid_dropout_p=0.1, token_dropout_p=0.1, learn_te=True).eval()
+    return tokenizer, model
+
+
+def _inputs(batch_size, seq_len, pred_len):
+    generator = torch.Generator().manual_seed(1)
+    x = torch.randn(batch_size, seq_len, 6, generator=generator)
+    x_stamp = torch.randint(0, 5, (batch_size, seq_len, 5), generator=generator).float()
+    y_stamp = torch.randint(0, 5, (batch_size, pred_len, 5), generator=generator).float()
+    return x, x_stamp, y_stamp
+
+
+@torch.no_grad()
+def full_recompute(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, sample_count, clip=5, T=1.0, top_k=0, top_p=0.9):
+    """Reference decoding without any KV cache: every step re-runs the model on the last max_context tokens."""
+    batch_size = x.size(0)
+    x = torch.clip(x, -clip, clip).repeat_interleave(sample_count, dim=0)
+    stamp = torch.cat([x_stamp, y_stamp], dim=1).repeat_interleave(sample_count, dim=0)
+    seeds = torch.full((x.size(0),), SEED, dtype=torch.long)
+    samples = torch.arange(sample_count).repeat(batch_size)
+
+    s1_ids, s2_ids = tokenizer.encode(x, half=True)
+    for i in range(pred_len):
+        seq_len = s1_ids.size(1)
+        start = max(seq_len - max_context, 0)
+        s1_logits, context = model.decode_s1(s1_ids[:, start:], s2_ids[:, start:], stamp[:, start:seq_len])
+        uniforms = counter_uniforms(seeds, samples, i)
+        sample_pre = sample_from_logits(s1_logits[:, -1], temperature=T, top_k=top_k, top_p=top_p, uniforms=uniforms[0])
+        s2_logits = model.decode_s2(context, sample_pre)
+        sample_post = sample_from_logits(s2_logits[:, -1], temperature=T, top_k=top_k, top_p=top_p, uniforms=uniforms[1])
+        s1_ids = torch.cat([s1_ids, sample_pre], dim=1)
+        s2_ids = torch.cat([s2_ids, sample_post], dim=1)
+
+    z = tokenizer.decode([s1_ids[:, -max_context:], s2_ids[:, -max_context:]], half=True)
+    return z.reshape(batch_size, sample_count, z.size(1), z.size(2)).mean(dim=1).numpy()
+
+
+@pytest.mark.parametrize("seq_len, pred_len, max_context", [
+    (20, 12, 64),  # the whole sequence fits in max_context
+    (20, 12, 25),  # generation outgrows max_context
+    (30, 8, 25),   # the history alone is longer than max_context
+])
+def test_cached_decoding_matches_full_recompute(models, seq_len, pred_len, max_context):
+    tokenizer, model = models
+    x, x_stamp, y_stamp = _inputs(3, seq_len, pred_len)
+    expected = full_recompute(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, sample_count=2)
+    actual = auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, max_context, pred_len, T=1.0, top_k=0, top_p=0.9,
+                                       sample_count=2, seed=SEED)
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(torch.from_numpy(actual), torch.from_numpy(expected), rtol=1e-4, atol=1e-4)
+
+
+def test_rolling_cache_within_max_context(models):
+    # rolling_cache only changes the decoding once the sequence outgrows max_context
+    tokenizer, model = models
+    x, x_stamp, y_stamp = _inputs(3, 20, 12)
+    expected = full_recompute(tokenizer, model, x, x_stamp, y_stamp, 64, 12, sample_count=2)
+    actual = auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, 64, 12, T=1.0, top_k=0, top_p=0.9, sample_count=2,
+                                       seed=SEED, rolling_cache=True)
+    torch.testing.assert_close(torch.from_numpy(actual), torch.from_numpy(expected), rtol=1e-4, atol=1e-4)
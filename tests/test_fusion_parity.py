@@ -0,0 +1,88 @@
+import copy
+
+import pytest
+import torch
+
+from model import Kronos, KronosTokenizer
+
+S1_BITS, S2_BITS = 4, 4
+
+
+@pytest.fixture(scope="module")
+def models():
+    torch.manual_seed(0)
+    tokenizer = KronosTokenizer(d_in=6, d_model=32, n_heads=4, ff_dim=64, n_enc_layers=2, n_dec_layers=2, ffn_dropout_p=0.1,
+                                attn_dropout_p=0.1, resid_dropout_p=0.1, s1_bits=S1_BITS, s2_bits=S2_BITS, beta=0.05, gamma0=1.0,
+                                gamma=1.1, zeta=0.05, group_size=4).eval()
+    model = Kronos(s1_bits=S1_BITS, s2_bits=S2_BITS, n_layers=2, d_model=32, n_heads=4, ff_dim=64, ffn_dropout_p=0.1, attn_dropout_p=0.1,
+                   resid_dropout_p=0.1, token_dropout_p=0.1, learn_te=True).eval()
+    return (tokenizer, model), (copy.deepcopy(tokenizer).fuse_for_inference(), copy.deepcopy(model).fuse_for_inference())
+
+
+def _tokens(batch_size=3, seq_len=24, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    s1 = torch.randint(0, 2 ** S1_BITS, (batch_size, seq_len), generator=generator)
+    s2 = torch.randint(0, 2 ** S2_BITS, (batch_size, seq_len), generator=generator)
+    stamp = torch.randint(0, 5, (batch_size, seq_len, 5), generator=generator).float()
+    return s1, s2, stamp
+
+
+def assert_close(actual, expected):
+    torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+
+@torch.no_grad()
+def test_model_full_sequence(models):
+    (_, model), (_, fused) = models
+    s1, s2, stamp = _tokens()
+    s1_logits, context = model.decode_s1(s1, s2, stamp)
+    fused_s1_logits, fused_context = fused.decode_s1(s1, s2, stamp)
+    assert_close(fused_s1_logits, s1_logits)
+    assert_close(fused_context, context)
+    assert_close(fused.decode_s2(fused_context, s1), model.decode_s2(context, s1))
+
+
+@torch.no_grad()
+@pytest.mark.parametrize("padded", [False, True])
+def test_model_cached(models, padded):
+    # Prefill with last_only, then decode the remaining positions one at a time through the KV cache.
+    (_, model), (_, fused) = models
+    s1, s2, stamp = _tokens()
+    padding_mask = torch.arange(s1.size(1))[None, :] < torch.tensor([0, 2, 5])[:, None] if padded else None
+    prefill_len = 16
+
+    outputs = []
+    for m in (model, fused):
+        kv_cache = m.new_kv_cache()
+        logits = []
+        for start, end in [(0, prefill_len)] + [(i, i + 1) for i in range(prefill_len, s1.size(1))]:
+            mask = padding_mask[:, start:end] if padding_mask is not None else None
+            s1_logits, context = m.decode_s1(s1[:, start:end], s2[:, start:end], stamp[:, start:end], padding_mask=mask, kv_cache=kv_cache,
+                                             last_only=True)
+            s2_logits = m.decode_s2(context, s1[:, start:end], kv_cache=kv_cache, last_only=True)
+            logits.append(torch.cat([s1_logits, s2_logits], dim=-1))
+        outputs.append(torch.cat(logits, dim=1))
+    assert_close(outputs[1], outputs[0])
+
+
+@torch.no_grad()
+def test_tokenizer(models):
+    (tokenizer, _), (fused, _) = models
+    x = torch.randn(3, 24, 6, generator=torch.Generator().manual_seed(2))
+    padding_mask = torch.arange(24)[None, :] < torch.tensor([0, 3, 7])[:, None]
+    for mask in (None, padding_mask):
+        tokens = tokenizer.encode(x, half=True, padding_mask=mask)
+        fused_tokens = fused.encode(x, half=True, padding_mask=mask)
+        for t, fused_t in zip(tokens, fused_tokens):
+            assert torch.equal(fused_t, t)
+        assert_close(fused.decode(tokens, half=True, padding_mask=mask), tokenizer.decode(tokens, half=True, padding_mask=mask))
+
+    # Incremental decoding through the tokenizer KV cache.
+    tokens = tokenizer.encode(x, half=True)
+    outputs = []
+    for t in (tokenizer, fused):
+        kv_cache = t.new_kv_cache()
+        outputs.append(torch.cat([t.decode([tokens[0][:, :16], tokens[1][:, :16]], half=True, kv_cache=kv_cache)]
+                                 + [t.decode([tokens[0][:, i:i + 1], tokens[1][:, i:i + 1]], half=True, kv_cache=kv_cache) for i in range(16, 24)],
+                                 dim=1))
+    assert_close(outputs[1], outputs[0])
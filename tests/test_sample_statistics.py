@@ -0,0 +1,89 @@
+import pytest
+import torch
+
+from model.kronos import QuantileSketch, SampleStatistics
+
+LEVELS = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _samples(n_samples, distribution="normal", seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    samples = torch.randn(4, n_samples, 30, generator=generator)
+    if distribution == "exponential":
+        samples = samples.exp()
+    elif distribution == "bimodal":
+        samples = samples + torch.where(torch.rand(samples.shape, generator=generator) < 0.3, -5.0, 5.0)
+    return samples
+
+
+def _statistics(samples, chunk):
+    stats = SampleStatistics(LEVELS)
+    for samples_chunk in samples.split(chunk, dim=1):
+        stats.update(samples_chunk)
+    return stats
+
+
+@pytest.mark.parametrize("chunk", [1, 64, 200])
+def test_exact_below_capacity(chunk):
+    samples = _samples(200)
+    stats = _statistics(samples, chunk)
+    torch.testing.assert_close(stats.quantiles, torch.quantile(samples, torch.tensor(LEVELS), dim=1), rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("distribution", ["normal", "exponential", "bimodal"])
+@pytest.mark.parametrize("chunk", [64, 5000])
+def test_approximation_above_capacity(distribution, chunk):
+    # Measured by rank: the fraction of the observations at or below the estimate is close to the level.
+    samples = _samples(5000, distribution)
+    quantiles = _statistics(samples, chunk).quantiles
+    ranks = (samples.unsqueeze(0) <= quantiles.unsqueeze(2)).float().mean(dim=2)
+    assert (ranks - torch.tensor(LEVELS).view(-1, 1, 1)).abs().max() < 0.01
+
+
+def test_single_observation_and_nan_rows():
+    sketch = QuantileSketch()
+    sketch.update(torch.full((2, 1), 3.0))
+    assert (sketch.quantile(0.3) == 3.0).all()
+
+    samples = _samples(300)
+    samples[1, :, 10:] = float('nan')  # e.g. the steps past a series' horizon
+    quantiles = _statistics(samples, 64).quantiles
+    assert quantiles[:, 1, 10:].isnan().all()
+    assert quantiles[:, 0].isfinite().all() and quantiles[:, 1, :10].isfinite().all()
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 64, 1000])
+def test_chunk_merge(chunk):
+    samples = _samples(1000)
+    stats = _statistics(samples, chunk)
+    assert (stats.count == 1000).all()
+    torch.testing.assert_close(stats.mean, samples.mean(dim=1), rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(stats.std, samples.std(dim=1, unbiased=False), rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(stats.standard_error, samples.std(dim=1) / 1000 ** 0.5, rtol=1e-4, atol=1e-6)
+
+    # The compressed summaries of different chunkings agree up to the approximation error
+    ranks = (samples.unsqueeze(0) <= stats.quantiles.unsqueeze(2)).float().mean(dim=2)
+    single = (samples.unsqueeze(0) <= _statistics(samples, 1000).quantiles.unsqueeze(2)).float().mean(dim=2)
+    assert (ranks - single).abs().max() < 0.01
+
+
+def test_partial_chunks():
+    # Later chunks may cover only some batch rows, as in adaptive sampling
+    samples = _samples(300)
+    stats = SampleStatistics()
+    stats.update(samples[:, :100])
+    stats.update(samples[1:3, 100:200], index=torch.tensor([1, 2]))
+    stats.update(samples[2:, 200:], index=torch.tensor([2, 3]))
+    seen = [slice(0, 100), slice(0, 200), slice(0, 300), torch.cat([torch.arange(100), torch.arange(200, 300)])]
+    for row, index in enumerate(seen):
+        row_samples = samples[row, index]
+        assert stats.count[row] == len(row_samples)
+        torch.testing.assert_close(stats.mean[row], row_samples.mean(dim=0), rtol=1e-5, atol=1e-5)
+        torch.testing.assert_close(stats.std[row], row_samples.std(dim=0, unbiased=False), rtol=1e-4, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        SampleStatistics().update(samples[:1], index=torch.tensor([0]))
+    stats = SampleStatistics(LEVELS)
+    stats.update(samples[:, :100])
+    with pytest.raises(ValueError):
+        stats.update(samples[:1, 100:], index=torch.tensor([0]))
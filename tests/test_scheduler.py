@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from model import Kronos, KronosPredictor, KronosScheduler, KronosTokenizer
+
+DATA = Path(__file__).resolve().parents[1] / "examples" / "data" / "XSHG_5min_600977.csv"
+COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount']
+
+
+@pytest.fixture(scope="module")
+def predictor():
+    torch.manual_seed(0)
+    tokenizer = KronosTokenizer(d_in=6, d_model=32, n_heads=4, ff_dim=64, n_enc_layers=2, n_dec_layers=2, ffn_dropout_p=0.1,
+                                attn_dropout_p=0.1, resid_dropout_p=0.1, s1_bits=4, s2_bits=4, beta=0.05, gamma0=1.0,
+                                gamma=1.1, zeta=0.05, group_size=4).eval()
+    model = Kronos(s1_bits=4, s2_bits=4, n_layers=2, d_model=32, n_heads=4, ff_dim=64, ffn_dropout_p=0.1, attn_dropout_p=0.1,
+                   resid_dropout_p=0.1, token_dropout_p=0.1, learn_te=True).eval()
+    return KronosPredictor(model, tokenizer, device='cpu', max_context=64, rolling_cache=True)
+
+
+@pytest.fixture(scope="module")
+def df():
+    return pd.read_csv(DATA, parse_dates=['timestamps'])
+
+
+def _inputs(df, offset, seq_len, pred_len):
+    history = df.iloc[offset:offset + seq_len].reset_index(drop=True)
+    future = df.iloc[offset + seq_len:offset + seq_len + pred_len].reset_index(drop=True)
+    return history[COLUMNS], history['timestamps'], future['timestamps'], pred_len
+
+
+def test_scheduled_forecast_matches_predict(predictor, df):
+    # (offset, history length, pred_len, seed); the first request runs past max_context, the others join it mid-flight
+    requests = [(0, 40, 60, 7), (500, 25, 10, 8), (1000, 70, 40, None), (1500, 33, 20, 10)]
+
+    async def main():
+        async with KronosScheduler(predictor, max_batch_size=16) as scheduler:
+            first = asyncio.create_task(scheduler.submit(*_inputs(df, *requests[0][:3]), T=1.0, sample_count=3, seed=requests[0][3]))
+            await asyncio.sleep(0.01)
+            assert not first.done(), "the later requests should join while the first one is decoding"
+            later = [scheduler.submit(*_inputs(df, offset, seq_len, pred_len), T=1.0, sample_count=3, seed=seed)
+                     for offset, seq_len, pred_len, seed in requests[1:]]
+            return [await first] + list(await asyncio.gather(*later))
+
+    results = asyncio.run(main())
+    for (offset, seq_len, pred_len, seed), result in zip(requests, results):
+        inputs = _inputs(df, offset, seq_len, pred_len)
+        assert result.shape == (pred_len, len(COLUMNS))
+        assert (result.index == inputs[2]).all()
+        if seed is not None:
+            expected = predictor.predict(*inputs, T=1.0, sample_count=3, verbose=False, seed=seed)
+            np.testing.assert_allclose(result.values, expected.values, rtol=1e-4, atol=1e-4 * np.abs(expected.values).max())
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from model import Kronos, KronosPredictor, KronosTokenizer
+
+DATA = Path(__file__).resolve().parents[1] / "examples" / "data" / "XSHG_5min_600977.csv"
+COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount']
+# (offset, history length, pred_len) of each series; the longest ones outgrow max_context
+SPECS = [(0, 40, 20), (100, 25, 10), (200, 33, 5), (300, 60, 30)]
+SEEDS = [7, 8, 9, 10]
+
+
+@pytest.fixture(scope="module")
+def models():
+    torch.manual_seed(0)
+    tokenizer = KronosTokenizer(d_in=6, d_model=32, n_heads=4, ff_dim=64, n_enc_layers=2, n_dec_layers=2, ffn_dropout_p=0.1,
+                                attn_dropout_p=0.1, resid_dropout_p=0.1, s1_bits=4, s2_bits=4, beta=0.05, gamma0=1.0,
+                                gamma=1.1, zeta=0.05, group_size=4).eval()
+    model = Kronos(s1_bits=4, s2_bits=4, n_layers=2, d_model=32, n_heads=4, ff_dim=64, ffn_dropout_p=0.1, attn_dropout_p=0.1,
+                   resid_dropout_p=0.1, token_dropout_p=0.1, learn_te=True).eval()
+    return tokenizer, model
+
+
+@pytest.fixture(scope="module")
+def series():
+    df = pd.read_csv(DATA, parse_dates=['timestamps'])
+    inputs = []
+    for offset, seq_len, pred_len in SPECS:
+        history = df.iloc[offset:offset + seq_len].reset_index(drop=True)
+        future = df.iloc[offset + seq_len:offset + seq_len + pred_len].reset_index(drop=True)
+        inputs.append((history[COLUMNS], history['timestamps'], future['timestamps'], pred_len))
+    return inputs
+
+
+def _predict_batch(predictor, inputs, seeds, **kwargs):
+    df_list, x_timestamp_list, y_timestamp_list, pred_len = (list(v) for v in zip(*inputs))
+    return predictor.predict_batch(df_list, x_timestamp_list, y_timestamp_list, pred_len, T=1.0, sample_count=3, verbose=False,
+                                   seed=seeds, **kwargs)
+
+
+def assert_same_forecast(actual, expected):
+    assert actual.shape == expected.shape
+    assert (actual.index == expected.index).all()
+    np.testing.assert_allclose(actual.values, expected.values, rtol=1e-4, atol=1e-4 * np.abs(expected.values).max())
+
+
+@pytest.mark.parametrize("rolling_cache", [False, True])
+def test_ragged_batch_row_matches_predict(models, series, rolling_cache):
+    tokenizer, model = models
+    predictor = KronosPredictor(model, tokenizer, device='cpu', max_context=64, rolling_cache=rolling_cache)
+    batch = _predict_batch(predictor, series, SEEDS)
+    for inputs, seed, forecast in zip(series, SEEDS, batch):
+        assert_same_forecast(forecast, predictor.predict(*inputs, T=1.0, sample_count=3, verbose=False, seed=seed))
+
+
+def test_seeded_forecast_is_independent_of_batching(models, series):
+    tokenizer, model = models
+    predictor = KronosPredictor(model, tokenizer, device='cpu', max_context=64)
+    expected = _predict_batch(predictor, series, SEEDS)
+
+    # sample_chunk only changes how many samples are decoded at once
+    chunked = KronosPredictor(model, tokenizer, device='cpu', max_context=64, sample_chunk=1)
+    for actual, forecast in zip(_predict_batch(chunked, series, SEEDS), expected):
+        assert_same_forecast(actual, forecast)
+
+    # position in the batch
+    for actual, forecast in zip(_predict_batch(predictor, series[::-1], SEEDS[::-1])[::-1], expected):
+        assert_same_forecast(actual, forecast)
+
+    # batch composition
+    for actual, forecast in zip(_predict_batch(predictor, series[1:3], SEEDS[1:3]), expected[1:3]):
+        assert_same_forecast(actual, forecast)
+
+
+def test_seed_changes_forecast(models, series):
+    tokenizer, model = models
+    predictor = KronosPredictor(model, tokenizer, device='cpu', max_context=64)
+    forecast = predictor.predict(*series[0], T=1.0, sample_count=3, verbose=False, seed=7)
+    assert_same_forecast(predictor.predict(*series[0], T=1.0, sample_count=3, verbose=False, seed=7), forecast)
+    assert not np.allclose(predictor.predict(*series[0], T=1.0, sample_count=3, verbose=False, seed=70).values, forecast.values)
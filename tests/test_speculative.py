@@ -0,0 +1,68 @@
+import copy
+
+import pytest
+import torch
+
+from model import Kronos, KronosPredictor, KronosTokenizer
+from model.kronos import auto_regressive_inference, auto_regressive_speculative
+
+
+def _tokenizer(seed, bits=4):
+    torch.manual_seed(seed)
+    return KronosTokenizer(d_in=6, d_model=32, n_heads=4, ff_dim=64, n_enc_layers=2, n_dec_layers=2, ffn_dropout_p=0.1,
+                           attn_dropout_p=0.1, resid_dropout_p=0.1, s1_bits=bits, s2_bits=bits, beta=0.05, gamma0=1.0,
+                           gamma=1.1, zeta=0.05, group_size=4).eval()
+
+
+def _model(seed, bits=4, n_layers=2):
+    torch.manual_seed(seed)
+    return Kronos(s1_bits=bits, s2_bits=bits, n_layers=n_layers, d_model=32, n_heads=4, ff_dim=64, ffn_dropout_p=0.1, attn_dropout_p=0.1,
+                  resid_dropout_p=0.1, token_dropout_p=0.1, learn_te=True).eval()
+
+
+@pytest.fixture(scope="module")
+def models():
+    # The draft is a smaller, independently initialized model that shares the tokenizer, so it disagrees often.
+    return _tokenizer(0), _model(0), _model(1, n_layers=1)
+
+
+def _inputs(batch_size, seq_len, pred_len):
+    generator = torch.Generator().manual_seed(1)
+    x = torch.randn(batch_size, seq_len, 6, generator=generator)
+    x_stamp = torch.randint(0, 5, (batch_size, seq_len, 5), generator=generator).float()
+    y_stamp = torch.randint(0, 5, (batch_size, pred_len, 5), generator=generator).float()
+    return x, x_stamp, y_stamp
+
+
+@pytest.mark.parametrize("seq_len, pred_len, rolling_cache", [
+    (20, 12, False),
+    (40, 30, False),  # generation outgrows max_context
+    (40, 30, True),
+])
+@pytest.mark.parametrize("draft_steps", [1, 3])
+def test_greedy_speculative_matches_plain_decoding(models, seq_len, pred_len, rolling_cache, draft_steps):
+    # At a vanishing temperature both decoders pick the most likely token, so their outputs coincide.
+    tokenizer, model, draft_model = models
+    x, x_stamp, y_stamp = _inputs(3, seq_len, pred_len)
+    kwargs = dict(T=1e-6, top_k=0, top_p=0.9, sample_count=2, rolling_cache=rolling_cache)
+    expected = auto_regressive_inference(tokenizer, model, x, x_stamp, y_stamp, 64, pred_len, **kwargs)
+    actual = auto_regressive_speculative(tokenizer, model, copy.deepcopy(tokenizer), draft_model, x, x_stamp, y_stamp, 64, pred_len,
+                                         draft_steps=draft_steps, **kwargs)
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(torch.from_numpy(actual), torch.from_numpy(expected), rtol=1e-4, atol=1e-4)
+
+
+def test_incompatible_draft_is_rejected(models):
+    tokenizer, model, draft_model = models
+    KronosPredictor(model, tokenizer, device='cpu', draft_model=draft_model, draft_tokenizer=tokenizer)
+    KronosPredictor(model, tokenizer, device='cpu', draft_model=draft_model, draft_tokenizer=copy.deepcopy(tokenizer))
+
+    with pytest.raises(ValueError, match="draft_tokenizer"):
+        KronosPredictor(model, tokenizer, device='cpu', draft_model=draft_model)
+    with pytest.raises(ValueError, match="different tokenizer"):
+        KronosPredictor(model, tokenizer, device='cpu', draft_model=draft_model, draft_tokenizer=_tokenizer(9))
+    with pytest.raises(ValueError, match="bit tokens"):
+        KronosPredictor(model, tokenizer, device='cpu', draft_model=_model(1, bits=6, n_layers=1), draft_tokenizer=_tokenizer(0, bits=6))
+    x, x_stamp, y_stamp = _inputs(1, 20, 5)
+    with pytest.raises(ValueError, match="bit tokens"):
+        auto_regressive_speculative(tokenizer, model, tokenizer, _model(1, bits=6, n_layers=1), x, x_stamp, y_stamp, 64, 5)